@@ -0,0 +1,59 @@
+import importlib
+import os
+
+from typing import *
+
+PLUGINS_VAR = "SESAME_PLUGINS"      # Comma-separated modules that register further backends when they are imported
+
+
+class Registry:
+    """Backends (e.g. the reductions of vectorizer.py) by name, imported on first use.
+
+    A backend is registered as a factory, or as the import path
+    "module:attribute" of one. Paths are only imported when the backend is
+    first requested, so registering a backend costs nothing until it is used.
+    Names that are not registered are looked up again after importing the
+    plugin modules listed in the environment variable SESAME_PLUGINS, which
+    can register third-party backends in every process, including workers.
+    """
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.__factories = dict()
+
+    def register(self, name: str, factory: Union[str, Callable[..., Any]], replace: bool = False):
+        if name in self.__factories and not replace:
+            raise ValueError("A " + self.kind + " named " + name + " is already registered")
+        self.__factories[name] = factory
+
+    def names(self) -> List[str]:
+        return sorted(self.__factories)
+
+    def __contains__(self, name: str) -> bool:
+        if name not in self.__factories:
+            load_plugins()
+        return name in self.__factories
+
+    def get(self, name: str) -> Callable[..., Any]:
+        """The factory of a backend, importing it if necessary."""
+        if name not in self:
+            raise Exception("Unknown " + self.kind + ": " + str(name))
+        factory = self.__factories[name]
+        if isinstance(factory, str):
+            (module, attribute) = factory.split(":")
+            factory = getattr(importlib.import_module(module), attribute)
+            self.__factories[name] = factory
+        return factory
+
+
+_plugins_loaded = False
+
+def load_plugins():
+    """Imports the modules in SESAME_PLUGINS (once per process), so they can register their backends."""
+    global _plugins_loaded
+    if _plugins_loaded:
+        return
+    _plugins_loaded = True
+    for module in os.environ.get(PLUGINS_VAR, "").split(","):
+        if module.strip():
+            importlib.import_module(module.strip())
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+# Compares float32 vectors (vectorizer.get_vectorizer with dtype=np.float32)
+# with the default float64 ones: memory, fit and transform speed, size of the
+# vectors of the corpus, speed of the similarity computation of calcsim.py,
+# and the quality on a classified sample of method pairs (e.g.
+# sampled-pairs.csv or simopt.in).
+
+import argparse
+import time
+
+from multiprocessing import Process, Queue
+
+import numpy as np
+from scipy.sparse import isspmatrix
+
+import corpus
+import pairsample
+import simblock
+import vectorizer
+
+
+def parse_tsim(spec):
+    # e.g. "none" or "lsa:200"
+    (tid, *size) = spec.split(":")
+    return (tid, ) + tuple( int(s) for s in size )
+
+
+def nbytes(X):
+    if isspmatrix(X):
+        return X.data.nbytes + X.indices.nbytes + X.indptr.nbytes
+    return np.asarray(X).nbytes
+
+
+def run(config, dtype, results):
+    # Runs in a fresh process, so the peak RSS belongs to this configuration alone
+    source = corpus.CorpusSource(args.db)
+    rss_before = corpus.peak_rss_mb()
+    start = time.time()
+    vect = vectorizer.get_vectorizer(source, *config, n_jobs=args.jobs, dtype=dtype)
+    fit_seconds = time.time() - start
+    start = time.time()
+    X = vect.transform(source)
+    transform_seconds = time.time() - start
+    rss = corpus.peak_rss_mb() - rss_before
+
+    # One block of calcsim.py against the whole corpus
+    start = time.time()
+    X = simblock.normalize_rows(X)
+    for (qstart, qstop) in simblock.blocks(min(args.block_size, X.shape[0]), args.query_block):
+        simblock.positive_entries(simblock.block_sims(X[qstart:qstop], X))
+    sim_seconds = time.time() - start
+
+    vecs = simblock.normalize_rows(vect.transform(np.asarray([ w for (id1, id2, w1, w2, cat) in samples for w in (w1, w2) ])))
+    if isspmatrix(vecs):
+        sims = np.asarray(vecs[0::2].multiply(vecs[1::2]).sum(1)).ravel()
+    else:
+        sims = (vecs[0::2] * vecs[1::2]).sum(1)
+    results.put((fit_seconds, X.shape[0] / transform_seconds, rss, nbytes(X), sim_seconds, X.dtype.name, sims.astype(np.float64)))
+
+
+parser = argparse.ArgumentParser(description="Benchmarks float32 against float64 vectors")
+parser.add_argument("samples", help="classified method pairs, e.g. sampled-pairs.csv")
+parser.add_argument("--db", default="./docs-train.db", help="database of the corpus (default: ./docs-train.db)")
+parser.add_argument("--vsm", default="ppmicds", choices=["tfidf", "ppmi", "ppmicds"], help="vsm (default: ppmicds)")
+parser.add_argument("--tsims", type=parse_tsim, nargs="+", default=[("none", ), ("lsa", 200)],
+    help="reductions to compare, e.g. none lsa:200 nmf:100 (default: none lsa:200)")
+parser.add_argument("--ngram", type=int, default=3, help="n-gram length (default: 3)")
+parser.add_argument("--max-df", type=float, default=0.9, help="max_df (default: 0.9)")
+parser.add_argument("--block-size", type=int, default=4096, help="methods scored against the corpus (default: 4096)")
+parser.add_argument("--query-block", type=int, default=1024, help="methods scored at once (default: 1024)")
+parser.add_argument("--jobs", type=int, default=1, help="processes of the vectorizer (default: 1)")
+args = parser.parse_args()
+
+samples = pairsample.load_samples(args.db, args.samples)
+cats = np.asarray([ cat for (id1, id2, w1, w2, cat) in samples ])
+print("samples: " + str(len(samples)))
+
+print("%-20s %-8s %8s %10s %10s %12s %8s %10s %9s %9s %9s" % ("tsim", "dtype", "fit s", "docs/s", "RSS MiB", "vectors MiB", "sim s",
+    "SSE", "precision", "sim corr", "max diff"))
+for tsim in args.tsims:
+    config = (("all", ), args.vsm, tsim, False, args.max_df, True, tsim[0] != "none", args.ngram)
+    exact_sims = None
+    for dtype in [np.float64, np.float32]:
+        results = Queue()
+        process = Process(target=run, args=(config, dtype, results))
+        process.start()
+        (fit_seconds, docs_per_second, rss, vector_bytes, sim_seconds, dtype_name, sims) = results.get()
+        process.join()
+        if exact_sims is None:
+            exact_sims = sims
+        (sse, precision) = pairsample.quality(sims, cats)
+        print("%-20s %-8s %8.2f %10.0f %10.1f %12.2f %8.2f %10.3f %9.3f %9.6f %9.2e" % (" ".join( str(t) for t in tsim ), dtype_name,
+            fit_seconds, docs_per_second, rss, vector_bytes / 1048576.0, sim_seconds, sse, precision,
+            np.corrcoef(exact_sims, sims)[0, 1], np.abs(exact_sims - sims).max()))
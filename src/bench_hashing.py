@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+# Compares the exact vocabulary-based vsm with its feature hashing variant
+# (vectorizer.get_vectorizer with vsm ("hash" + vsm, buckets)): memory, fit and
+# transform speed, size of the pickled vectorizer, and the quality on a
+# classified sample of method pairs (e.g. sampled-pairs.csv or simopt.in).
+
+import argparse
+import pickle
+import time
+
+from multiprocessing import Process, Queue
+
+import numpy as np
+
+from sklearn.preprocessing import normalize
+
+import corpus
+import pairsample
+import vectorizer
+
+
+def run(config, n_jobs, results):
+    # Runs in a fresh process (that may start processes itself), so the peak RSS belongs to this configuration alone
+    source = corpus.CorpusSource(args.db)
+    rss_before = corpus.peak_rss_mb()
+    start = time.time()
+    vect = vectorizer.get_vectorizer(source, *config, n_jobs=n_jobs)
+    fit_seconds = time.time() - start
+    start = time.time()
+    n_docs = vect.transform(source).shape[0]
+    transform_seconds = time.time() - start
+    rss = corpus.peak_rss_mb() - rss_before
+
+    vecs = normalize(vect.transform(np.asarray([ w for (id1, id2, w1, w2, cat) in samples for w in (w1, w2) ])))
+    sims = np.asarray(vecs[0::2].multiply(vecs[1::2]).sum(1)).ravel()
+    results.put((fit_seconds, n_docs / transform_seconds, rss, len(pickle.dumps(vect)), sims))
+
+
+parser = argparse.ArgumentParser(description="Benchmarks feature hashing against the exact vsm")
+parser.add_argument("samples", help="classified method pairs, e.g. sampled-pairs.csv")
+parser.add_argument("--db", default="./docs-train.db", help="database of the corpus (default: ./docs-train.db)")
+parser.add_argument("--vsm", default="ppmicds", choices=["tfidf", "ppmi", "ppmicds"], help="exact vsm to compare with (default: ppmicds)")
+parser.add_argument("--buckets", type=int, nargs="+", default=[2 ** 16, 2 ** 18, 2 ** 20, 2 ** 22],
+    help="numbers of buckets to compare (default: 2^16 2^18 2^20 2^22)")
+parser.add_argument("--ngram", type=int, default=3, help="n-gram length (default: 3)")
+parser.add_argument("--max-df", type=float, default=0.9, help="max_df (default: 0.9)")
+parser.add_argument("--jobs", type=int, default=1, help="processes of the hashed vsm (default: 1)")
+args = parser.parse_args()
+
+samples = pairsample.load_samples(args.db, args.samples)
+cats = np.asarray([ cat for (id1, id2, w1, w2, cat) in samples ])
+print("samples: " + str(len(samples)))
+
+variants = [ (args.vsm, args.vsm, 1) ] + [ (args.vsm + " hashed 2^%d" % int(np.log2(b)), ("hash" + args.vsm, b), args.jobs) for b in args.buckets ]
+exact_sims = None
+print("%-24s %8s %10s %10s %12s %10s %9s %9s %9s" % ("vsm", "fit s", "docs/s", "RSS MiB", "pickle MiB", "SSE", "precision", "sim corr", "sim diff"))
+for (name, vsm, n_jobs) in variants:
+    config = (("all", ), vsm, ("none", ), False, args.max_df, True, False, args.ngram)
+    results = Queue()
+    process = Process(target=run, args=(config, n_jobs, results))
+    process.start()
+    (fit_seconds, docs_per_second, rss, pickled, sims) = results.get()
+    process.join()
+    if exact_sims is None:
+        exact_sims = sims
+    (sse, precision) = pairsample.quality(sims, cats)
+    print("%-24s %8.2f %10.0f %10.1f %12.2f %10.3f %9.3f %9.4f %9.4f" % (name, fit_seconds, docs_per_second, rss, pickled / 1048576.0,
+        sse, precision, np.corrcoef(exact_sims, sims)[0, 1], np.abs(exact_sims - sims).mean()))
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+
+# Measures the time of importing a module (by default vectorizer) in fresh
+# interpreters, lists the imports that take longest, and fails if the median
+# exceeds the import-time budget. The backends of vectorizer.py import their
+# libraries on first use, so e.g. gensim and sklearn's decompositions must not
+# show up here.
+
+import argparse
+import statistics
+import subprocess
+import sys
+
+IMPORT_BUDGET = 0.5     # Seconds for import vectorizer (median)
+
+
+def import_seconds(module):
+    # Wall time of the import alone, in a fresh interpreter
+    code = "import time; start = time.perf_counter(); import " + module + "; print(time.perf_counter() - start)"
+    return float(subprocess.check_output([ sys.executable, "-c", code ], universal_newlines=True))
+
+
+def slowest_imports(module, n):
+    # (cumulative seconds, module) of the slowest imports by -X importtime, nested ones included
+    stderr = subprocess.run([ sys.executable, "-X", "importtime", "-c", "import " + module ], stderr=subprocess.PIPE,
+        universal_newlines=True).stderr
+    imports = list()
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line or "cumulative" in line:
+            continue
+        (own, cumulative, name) = line[len("import time:"):].split("|")
+        imports.append((int(cumulative) / 1e6, name.rstrip()))
+    return sorted(imports, reverse=True)[:n]
+
+
+parser = argparse.ArgumentParser(description="Checks the import time of a module against a budget")
+parser.add_argument("--module", default="vectorizer", help="module to import (default: vectorizer)")
+parser.add_argument("--budget", type=float, default=IMPORT_BUDGET, help="budget in seconds (default: " + str(IMPORT_BUDGET) + ")")
+parser.add_argument("--runs", type=int, default=5, help="fresh interpreters to measure (default: 5)")
+parser.add_argument("--top", type=int, default=15, help="number of slowest imports to list (default: 15)")
+args = parser.parse_args()
+
+seconds = [ import_seconds(args.module) for i in range(args.runs) ]
+for (cumulative, name) in slowest_imports(args.module, args.top):
+    print("%8.3f s  %s" % (cumulative, name))
+median = statistics.median(seconds)
+print("import %s: median %.3f s, min %.3f s over %d runs (budget %.3f s)" % (args.module, median, min(seconds), args.runs, args.budget))
+if median > args.budget:
+    print("[E] import " + args.module + " exceeds its budget")
+    sys.exit(1)
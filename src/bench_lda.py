@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+
+# Compares fitting LDA (topics.BudgetedLDA) with many topics from scratch with
+# fitting it warm-started from the topics of an LDA with fewer topics, as
+# simopt.py does: passes, fit time and perplexity of the corpus.
+
+import argparse
+import time
+
+import corpus
+import topics
+import vectorizer
+
+
+def fit(n_topics, warm_start=None):
+    lda = topics.BudgetedLDA(n_topics=n_topics, max_seconds=args.max_seconds, warm_start=warm_start, n_jobs=args.jobs)
+    start = time.time()
+    lda.fit(X)
+    print("%-12s %6d %6d %8.2f %12.1f" % ("warm" if warm_start is not None else "cold", n_topics, lda.n_iter_,
+        time.time() - start, lda.perplexity(X)))
+    return lda
+
+
+parser = argparse.ArgumentParser(description="Benchmarks warm-started against cold LDA fits")
+parser.add_argument("--db", default="./docs-train.db", help="database of the corpus (default: ./docs-train.db)")
+parser.add_argument("--vsm", default="tfidf", choices=["tfidf", "ppmi", "ppmicds"], help="vsm (default: tfidf)")
+parser.add_argument("--ngram", type=int, default=1, help="n-gram length (default: 1)")
+parser.add_argument("--max-df", type=float, default=0.9, help="max_df (default: 0.9)")
+parser.add_argument("--small", type=int, default=50, help="topics of the model warm-started from (default: 50)")
+parser.add_argument("--large", type=int, default=100, help="topics of the compared models (default: 100)")
+parser.add_argument("--max-seconds", type=float, default=None, help="budget of every fit (default: none)")
+parser.add_argument("--jobs", type=int, default=-1, help="cores of every fit (default: -1, i.e., all cores)")
+args = parser.parse_args()
+
+source = corpus.CorpusSource(args.db)
+(weighting, X) = vectorizer.fit_weighting(source, ("all", ), args.vsm, False, args.max_df, True, args.ngram, args.jobs)
+print("documents: %d, features: %d" % X.shape)
+
+print("%-12s %6s %6s %8s %12s" % ("start", "topics", "passes", "fit s", "perplexity"))
+fit(args.large)
+fit(args.large, fit(args.small))
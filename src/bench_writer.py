@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+# Compares the insertion rate into internal_methodsim of the former calcsim.py
+# result loop with simwriter.MethodSimWriter on synthetic result chunks.
+
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+import simwriter
+
+
+def mk_chunks(n_rows, chunk_rows, seed):
+    # Chunks as calcsim.py workers produce them: a block of 64 first ids
+    # against a block of second ids, arriving in arbitrary order
+    n_chunks = max(1, n_rows // chunk_rows)
+    order = list(range(n_chunks))
+    random.Random(seed).shuffle(order)
+    for k in order:
+        rnd = random.Random(seed + k)
+        second_base = rnd.randrange(0, 10 * n_rows)
+        seconds = rnd.sample(range(4096), chunk_rows // 64)
+        yield sorted((f, second_base + s, rnd.random()) for f in range(64 * k, 64 * (k + 1)) for s in seconds)
+
+
+def bench_before(path, chunks):
+    conn = sqlite3.connect(path)
+    c = conn.cursor()
+    simwriter.create_tables(conn, True)
+    start = time.time()
+    counter = 0
+    for result in chunks:
+        c.executemany('''INSERT INTO internal_methodsim VALUES (?, ?, ?, -1)''', result)
+        counter += 1
+        if counter > 100:
+            conn.commit()
+            counter = 0
+    conn.commit()
+    conn.close()
+    return time.time() - start
+
+
+def bench_after(path, chunks, with_pk):
+    conn = sqlite3.connect(path)
+    simwriter.create_tables(conn, with_pk)
+    conn.close()
+    start = time.time()
+    writer = simwriter.MethodSimWriter(path, with_pk)
+    for result in chunks:
+        writer.put(result)
+    writer.close()
+    return time.time() - start
+
+
+parser = argparse.ArgumentParser(description="Benchmarks the insertion into internal_methodsim")
+parser.add_argument("--rows", type=int, default=2000000, help="number of rows to insert (default: 2000000)")
+parser.add_argument("--chunk-rows", type=int, default=2048, help="rows per result chunk (default: 2048)")
+parser.add_argument("--dir", default=None, help="directory for the temporary databases")
+args = parser.parse_args()
+
+n_rows = sum(len(c) for c in mk_chunks(args.rows, args.chunk_rows, 410))
+print("rows: " + str(n_rows))
+
+with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+    for (i, (name, fun)) in enumerate([("before (executemany per chunk, PK)", lambda p: bench_before(p, mk_chunks(args.rows, args.chunk_rows, 410))),
+            ("after (MethodSimWriter, PK)", lambda p: bench_after(p, mk_chunks(args.rows, args.chunk_rows, 410), True)),
+            ("after (MethodSimWriter, --late-index)", lambda p: bench_after(p, mk_chunks(args.rows, args.chunk_rows, 410), False))]):
+        path = os.path.join(tmp, "bench" + str(i) + ".db")
+        duration = fun(path)
+        print("%-40s %8.2f s %12.0f rows/s" % (name, duration, n_rows / duration))
@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
 
+import argparse
+import os
 import time
 import sqlite3
 import sys
@@ -9,12 +11,18 @@ from multiprocessing import Pool
 from pathlib import Path
 
 import numpy as np
+from scipy.sparse import isspmatrix
 
 from sklearn.decomposition import TruncatedSVD
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
 
-import vectorizer
+import corpus
+import fitcache
+import invindex
+import simblock
+import simmetrics
+import simwriter
+import vecstore
 
 
 
@@ -36,97 +44,174 @@ def mk_vecs(words1, words2):
 
 
 
-def calc_proj_sim(input_pair):
-	(project, projwordslist, otherwordslist) = input_pair
-	result = list()
-	for (id1, words1) in projwordslist:
-		for (id2, words2) in otherwordslist:
-			sim_cs = float(cosine_similarity(words1, words2))
-			if sim_cs > 0.0:
-				result.append((id1, id2, sim_cs))
-	return (project, result)
-
-
-
-conn = sqlite3.connect('./docs.db')
-c = conn.cursor()
-
-# Create table
-c.execute('''CREATE TABLE IF NOT EXISTS internal_methodsim
-		(first_id INT, second_id INT, sim_cs REAL, sim_tok REAL DEFAULT -1,
-			PRIMARY KEY (first_id, second_id))''')
-
-c.execute('''CREATE VIEW IF NOT EXISTS methodsim
-		(project1, project2, file1, file2, method1, method2, sim_cs, sim_tok) AS
-			SELECT p1.name, p2.name, d1.file, d2.file, d1.method, d2.method, s.sim_cs, s.sim_tok
-				FROM internal_methodsim s JOIN internal_filtered_methoddocs d1 ON s.first_id = d1.id
-					JOIN projects p1 ON d1.project_id = p1.id
-					JOIN internal_filtered_methoddocs d2 ON s.second_id = d2.id
-					JOIN projects p2 ON d2.project_id = p2.id''')
+def parse_shard(spec):
+	(i, n) = spec.split("/")
+	if not 0 <= int(i) < int(n):
+		raise argparse.ArgumentTypeError("shard must be i/N with 0 <= i < N")
+	return (int(i), int(n))
+
+
+def init_worker(store_path, worker_maxweights):
+	# Every worker maps the vector store itself, so tasks only carry row ranges
+	global store, maxweights
+	store = vecstore.VectorStore(store_path)
+	maxweights = worker_maxweights
+
+
+def calc_block_sim(input_block):
+	(unit, start1, stop1, start2, stop2) = input_block
+	timer = simmetrics.StageTimer()
+	vecs2 = simblock.normalize_rows(store.matrix[start2:stop2])
+	timer.lap("normalize")
+	if isspmatrix(vecs2):
+		# Only score pairs that share a term and can reach the minimum similarity
+		index = invindex.InvertedIndex(vecs2, args.min_sim, maxweights)
+		timer.lap("index")
+	(firsts, seconds, sims) = (list(), list(), list())
+	for (qstart, qstop) in simblock.blocks(stop1 - start1, args.query_block):
+		vecs1 = simblock.normalize_rows(store.matrix[start1 + qstart:start1 + qstop])
+		timer.lap("normalize")
+		if isspmatrix(vecs2):
+			(rows, cols, block_sims) = index.pairs(vecs1)
+		else:
+			(rows, cols, block_sims) = simblock.positive_entries(simblock.block_sims(vecs1, vecs2), args.min_sim)
+		timer.lap("score")
+		firsts.append(rows + start1 + qstart)
+		seconds.append(cols + start2)
+		sims.append(block_sims)
+	(first, second, sims) = (np.concatenate(firsts), np.concatenate(seconds), np.concatenate(sims))
+
+	# Blocks on the diagonal hold every unordered pair twice, keep the upper triangle
+	keep = first <= second if args.both_orders else first < second
+	(first, second, sims) = (first[keep], second[keep], sims[keep])
+	if args.both_orders:
+		# Pairs within a project are also stored the other way round
+		mirror = (first != second) & (store.project_ids[first] == store.project_ids[second])
+		(first, second, sims) = (np.concatenate((first, second[mirror])),
+			np.concatenate((second, first[mirror])), np.concatenate((sims, sims[mirror])))
+
+	result = list(zip(store.ids[first].tolist(), store.ids[second].tolist(), sims.tolist()))
+	# Presorted chunks make the writer's sort a cheap merge
+	result.sort()
+	timer.lap("collect")
+	return (unit, result, timer.stats())
+
+
+def tile_pairs(start1, stop1, start2, stop2):
+	# Number of unordered pairs of methods a block covers
+	if start1 == start2:
+		return (stop1 - start1) * (stop1 - start1 - 1) // 2
+	return (stop1 - start1) * (stop2 - start2)
+
+
+parser = argparse.ArgumentParser(description="Calculates the similarity of all method pairs in docs.db")
+parser.add_argument("--block-size", type=int, default=4096,
+	help="number of methods per block of the similarity matrix (default: 4096)")
+parser.add_argument("--query-block", type=int, default=1024,
+	help="number of methods scored at once against a block (default: 1024)")
+parser.add_argument("--min-sim", type=float, default=0.0,
+	help="only store pairs with at least this similarity (default: 0.0, i.e., all pairs with sim > 0)")
+parser.add_argument("--late-index", action="store_true",
+	help="create internal_methodsim without primary key and build its unique index after all pairs are inserted")
+parser.add_argument("--both-orders", action="store_true",
+	help="like earlier versions, also store the pairs within a project in reverse order and each method with itself")
+parser.add_argument("--shard", type=parse_shard, default=(0, 1),
+	help="only compute shard i of N of all blocks, given as i/N (default: 0/1)")
+parser.add_argument("--output", default=None,
+	help="database to write the similarities to (default: docs.db, required with --shard)")
+parser.add_argument("--metrics-jsonl", default=None,
+	help="append periodic snapshots of the progress metrics to this JSON-lines file")
+parser.add_argument("--metrics-prom", default=None,
+	help="keep the progress metrics in this Prometheus textfile (e.g. for the textfile collector of node_exporter)")
+parser.add_argument("--metrics-interval", type=float, default=simmetrics.INTERVAL,
+	help="seconds between metrics snapshots and progress reports (default: " + str(simmetrics.INTERVAL) + ")")
+parser.add_argument("--jobs", type=int, default=-1,
+	help="number of processes to vectorize the methods with (default: -1, i.e., all cores)")
+parser.add_argument("--dtype", default="float64", choices=["float64", "float32"],
+	help="floating point type of the vectors and similarities (default: float64; float32 halves their memory)")
+parser.add_argument("--store-dir", default=vecstore.STORE_DIR,
+	help="directory of the vector stores (default: " + vecstore.STORE_DIR + ")")
+args = parser.parse_args()
+
+(shard, shards) = args.shard
+if shards > 1 and args.output is None:
+	parser.error("--shard requires --output")
+out_path = args.output if args.output is not None else './docs.db'
+
+# Create table (shard databases only hold internal_methodsim and its journal)
+outconn = sqlite3.connect(out_path)
+simwriter.create_tables(outconn, not args.late_index, args.output is None)
 
 print("Build corpus")
-c.execute("SELECT kwset FROM internal_filtered_methoddocs")
-
-vect = vectorizer.get_vectorizer([ row[0] for row in c.fetchall() ], ('var', 1e-08), 'ppmicds', ('none',), False, 0.9, False, False, 3)
+config = (('var', 1e-08), 'ppmicds', ('none',), False, 0.9, False, False, 3)
+source = corpus.CorpusSource('./docs.db')
+
+# Units that were committed by an earlier, interrupted run with the same vectors and flags are skipped
+done = simwriter.load_progress(outconn, args.block_size, vecstore.fingerprint(config, source.digest(), args.dtype),
+	args.min_sim, args.both_orders, args.dtype)
+
+# The vectors of all methods are computed once and reused across runs
+vectorize_start = time.perf_counter()
+store = vecstore.get_store(config, source, lambda: fitcache.get_vectorizer(source, *config, n_jobs=args.jobs, dtype=args.dtype), args.store_dir,
+	vecstore.BATCH_SIZE * (args.jobs if args.jobs > 0 else os.cpu_count()), args.dtype)
+vectorize_seconds = time.perf_counter() - vectorize_start
+print("Peak RSS: %.1f MiB" % corpus.peak_rss_mb())
+
+# Maximal weight of each term, used to prune candidates that cannot reach the minimum similarity
+maxweights = None
+if args.min_sim > 0.0 and isspmatrix(store.matrix):
+	maxweights = simblock.normalize_rows(store.matrix).max(0).toarray().ravel()
+
+# Tile the upper triangle of the similarity matrix into blocks of about the same number of non-zeros.
+# The (block1, block2) units are dealt round-robin to the shards in the order of the whole grid.
+if isspmatrix(store.matrix):
+	weights = np.diff(store.matrix.indptr) + 1
+else:
+	weights = np.ones(len(store.ids))
+bounds = simblock.balanced_blocks(weights, args.block_size)
+grid = [ unit for (k, unit) in enumerate(simblock.triangle(len(bounds))) if k % shards == shard ]
+if args.output is not None:
+	simwriter.record_shard(outconn, shard, shards, args.block_size, os.path.basename(store.path), len(grid))
+outconn.close()
+
+# Block rows are started in order, so each block row stays in the workers' caches while it is reused
+units = [ ((bi, bj), bounds[bi][0], bounds[bi][1], bounds[bj][0], bounds[bj][1])
+	for (bi, bj) in grid if (bi, bj) not in done ]
+remaining = dict()
+for (unit, start1, stop1, start2, stop2) in units:
+	remaining[unit[0]] = remaining.get(unit[0], 0) + 1
+print(str(len(grid) - len(units)) + " of " + str(len(grid)) + " blocks already done")
+sys.stdout.flush()
 
 print("Calculate similarity")
-pool = Pool()
-
-c.execute('SELECT coalesce(max(first_id), -1) FROM internal_methodsim')
-max_proc_id = int(c.fetchone()[0])
-
-# Iterate over projects
-c.execute('''SELECT id, name FROM projects''')
-for tpproject in c.fetchall():
-	project_id = tpproject[0]
-	project = tpproject[1]
-	start_time = time.time()
-	print("Begin project " + project, file=sys.stderr)
-	# Check whether project has already been processed
-	c.execute('''SELECT count(*) FROM internal_filtered_methoddocs
-		WHERE project_id = ? AND id > ?''', (project_id, max_proc_id))
-	if int(c.fetchone()[0]) == 0:
-		print("Skipping project " + project)
+pool = Pool(initializer=init_worker, initargs=(store.path, maxweights))
+writer = simwriter.MethodSimWriter(out_path, not args.late_index, block_size=args.block_size)
+
+# The ETA is based on the pairs of the blocks that are left to compute
+metrics = simmetrics.Metrics(sum( tile_pairs(*unit[1:]) for unit in units ),
+	args.metrics_jsonl, args.metrics_prom, args.metrics_interval)
+metrics.add_seconds({ "vectorize": vectorize_seconds })
+metrics.stage("insert", lambda: writer.commit_seconds)
+metrics.gauge("rows_committed", lambda: writer.rows_committed)
+metrics.gauge("writer_queue_depth", writer.qsize)
+metrics.gauge("tasks_pending", lambda: len(units) - tasks_done)
+metrics.start()
+tasks_done = 0
+
+start_time = time.time()
+for (unit, result, stats) in pool.imap_unordered(calc_block_sim, units):
+	put_start = time.perf_counter()
+	writer.put(result, unit)
+	metrics.add_seconds({ "wait_writer": time.perf_counter() - put_start })
+	metrics.add_worker(stats)
+	metrics.add("blocks")
+	metrics.add("pairs_scored", tile_pairs(*bounds[unit[0]], *bounds[unit[1]]))
+	metrics.add("pairs_emitted", len(result))
+	tasks_done += 1
+	remaining[unit[0]] -= 1
+	if remaining[unit[0]] == 0:
+		print("Finished block row " + str(unit[0] + 1) + " of " + str(len(bounds)) + " after " + str(time.time() - start_time) + " s")
 		sys.stdout.flush()
-		continue
-
-	# Get all methods from the project
-	c.execute('''SELECT id, project_id, file, method, kwset FROM internal_filtered_methoddocs
-			WHERE project_id = ? AND id > ?''', (project_id, max_proc_id))
-	projmethods = c.fetchall()
-
-	c.execute('''SELECT id, project_id, file, method, kwset FROM internal_filtered_methoddocs
-			WHERE project_id >= ?''', (project_id, ))
-	othermethods = c.fetchall()
-
-	projwordslist = list()
-	for projmethodrow in projmethods:
-		words1 = vect.transform(np.asarray([projmethodrow[4]]))
-		projwordslist.append((projmethodrow[0], words1))
-
-	inputs = list()
-	current = list()
-	for othermethodrow in othermethods:
-		words2 = vect.transform(np.asarray([othermethodrow[4]]))
-		current.append((othermethodrow[0], words2))
-		if len(current) >= 64:
-			inputs.append((project, projwordslist, current))
-			current = list()
-		
-	if len(current) > 0:
-		inputs.append((project, projwordslist, current))
-
-	counter = 0
-	for (pr, result) in pool.imap_unordered(calc_proj_sim, inputs):
-		c.executemany('''INSERT INTO internal_methodsim VALUES (?, ?, ?, -1)''', result)
-		counter += 1
-		if counter > 100:
-			conn.commit()
-			counter = 0
-
-	conn.commit()
-	end_time = time.time()
-	print("Finished " + project + " in " + str(end_time - start_time) + " s")
-	sys.stdout.flush()
-
-conn.close()
+
+writer.close()
+metrics.stop()
@@ -0,0 +1,69 @@
+import hashlib
+import resource
+import sqlite3
+
+from typing import *
+
+BATCH_SIZE = 4096
+
+CORPUS_QUERY = "SELECT id, project_id, kwset FROM internal_filtered_methoddocs ORDER BY project_id, id"
+
+
+class CorpusSource:
+    """The kwsets of all methods of a database, streamed from SQLite in batches.
+
+    Iterating yields the kwsets. Every iteration runs the query again on a
+    separate connection, so the corpus can be passed through several times
+    (e.g. by get_vectorizer and by the vector store) without ever being held
+    in memory as a whole.
+    """
+
+    def __init__(self, db_path: str, query: str = CORPUS_QUERY, batch_size: int = BATCH_SIZE):
+        self.db_path = db_path
+        self.__query = query
+        self.__batch_size = batch_size
+        self.__digest = None
+
+    def rows(self) -> Iterator[Tuple[int, int, str]]:
+        """Yields the (id, project_id, kwset) rows of all methods, ordered by (project_id, id)."""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            c = conn.cursor()
+            c.execute(self.__query)
+            while True:
+                batch = c.fetchmany(self.__batch_size)
+                if len(batch) == 0:
+                    break
+                yield from batch
+        finally:
+            conn.close()
+
+    def __iter__(self) -> Iterator[str]:
+        for row in self.rows():
+            yield row[2]
+
+    def __len__(self) -> int:
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return int(conn.execute("SELECT count(*) FROM (" + self.__query + ")").fetchone()[0])
+        finally:
+            conn.close()
+
+    def digest(self) -> str:
+        """Digest of all (id, project_id, kwset) rows."""
+        if self.__digest is None:
+            self.__digest = corpus_digest(self.rows())
+        return self.__digest
+
+
+def corpus_digest(corpus: Iterable[Tuple[int, int, str]]) -> str:
+    """Digest of a corpus given as (id, project_id, kwset) rows."""
+    h = hashlib.sha256()
+    for (mid, project_id, kwset) in corpus:
+        h.update(("%d\t%d\t%s\n" % (mid, project_id, kwset)).encode("utf-8"))
+    return h.hexdigest()
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process in MiB."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
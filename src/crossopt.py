@@ -9,26 +9,33 @@ from scipy.sparse import isspmatrix, csr_matrix
 
 from sklearn.metrics.pairwise import cosine_similarity
 
-import vectorizer
+import corpus
+import fitcache
+import vecstore
 
+JOBS = -1       # Cores for fitting (e.g. LDA) and vectorizing (-1: all)
 
 
 # Open DB connection
 conn = sqlite3.connect("./docs-train.db")
 c = conn.cursor()
 
-# Get vectorizer
-c.execute("SELECT kwset FROM internal_filtered_methoddocs")
-whole = [ row[0] for row in c.fetchall() ]
+# Get vector stores
+configs = [
+    (('all',), 'ppmi', ('lsa', 200), False, 1.0, False, False, 1),
+    (('all',), 'ppmi', ('lsa', 150), False, 1.0, True, False, 1),
+    (('var', 0.0015), 'ppmi', ('lsa', 500), False, 0.7, True, True, 2),
+    (('all',), 'ppmi', ('none',), False, 1.0, True, False, 1),
+    (('var', 1e-08), 'ppmicds', ('none',), False, 0.9, False, False, 3),
+    (('all',), 'ppmi', ('lda', 350), False, 0.8, True, False, 3),
+    ]
 
-vect0 = vectorizer.get_vectorizer(whole, ('all',), 'ppmi', ('lsa', 200), False, 1.0, False, False, 1)
-vect1 = vectorizer.get_vectorizer(whole, ('all',), 'ppmi', ('lsa', 150), False, 1.0, True, False, 1)
-vect2 = vectorizer.get_vectorizer(whole, ('var', 0.0015), 'ppmi', ('lsa', 500), False, 0.7, True, True, 2)
-vect3 = vectorizer.get_vectorizer(whole, ('all',), 'ppmi', ('none',), False, 1.0, True, False, 1)
-vect4 = vectorizer.get_vectorizer(whole, ('var', 1e-08), 'ppmicds', ('none',), False, 0.9, False, False, 3)
-vect5 = vectorizer.get_vectorizer(whole, ('all',), 'ppmi', ('lda', 350), False, 0.8, True, False, 3)
+whole = corpus.CorpusSource("./docs-train.db")
 
-vects = [vect0, vect1, vect2, vect3, vect4, vect5]
+# Each store is only fitted and vectorized if it is not on disk yet
+stores = [ vecstore.get_store(config, whole, lambda config=config: fitcache.get_vectorizer(whole, *config, n_jobs=JOBS))
+    for config in configs ]
+print("Peak RSS: %.1f MiB" % corpus.peak_rss_mb())
 
 c.execute("SELECT id FROM internal_filtered_methoddocs WHERE project_id != 7 AND project_id != 12")
 id_list = [ r[0] for r in c.fetchall() ]
@@ -41,22 +48,21 @@ tested = 0
 finish = False
 for j in id_list:
     finish = True
-    c.execute("""SELECT d1.file, d1.method, d1.kwset, d2.file, d2.method, d2.kwset
+    c.execute("""SELECT d1.id, d1.file, d1.method, d2.id, d2.file, d2.method
                  FROM internal_filtered_methoddocs d1, internal_filtered_methoddocs d2
                  WHERE d1.id = ? AND d1.project_id < d2.project_id AND d2.project_id != 7
                  AND d2.project_id != 12
                  ORDER BY RANDOM() LIMIT 10000""",
               (j, ))
-    for (file1, method1, kwset1, file2, method2, kwset2) in c:
+    for (id1, file1, method1, id2, file2, method2) in c:
         finish = False
         if (file1, method1) not in black and (file2, method2) not in black:
             if (tested % 8) == 0:
                 print("\r" + str(tested), end="")
 
             sims = list()
-            for vect in vects:
-                inp = np.asarray([kwset1, kwset2])
-                outp = vect.transform(inp)
+            for store in stores:
+                outp = store.vectors([id1, id2])
                 if not isspmatrix(outp):
                     outp = csr_matrix(outp)
                 sims.append(float(cosine_similarity(outp[0], outp[1])))
@@ -0,0 +1,145 @@
+import fcntl
+import hashlib
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+
+from contextlib import contextmanager
+from typing import *
+
+import numpy as np
+import scipy
+import sklearn
+
+try:
+    import joblib
+except ImportError:
+    from sklearn.externals import joblib
+
+import corpus
+import partransform
+import vectorizer
+
+CACHE_DIR = "fitcache"
+CACHE_VERSION = 3
+MAX_BYTES = 20 * 1024 ** 3    # 20 GiB
+
+
+def library_versions() -> str:
+    """Versions of everything a pickled pipeline depends on."""
+    # Imported here, so loading a cached pipeline without embeddings does not import gensim otherwise
+    import gensim
+    return ", ".join([ "python " + platform.python_version(), "numpy " + np.__version__, "scipy " + scipy.__version__,
+        "sklearn " + sklearn.__version__, "gensim " + gensim.__version__ ])
+
+
+def fingerprint(config: Tuple, digest: str, variant: str = "", dtype=np.float64) -> str:
+    """Key of a pipeline fitted on a corpus (by digest) under a get_vectorizer configuration.
+
+    variant distinguishes pipelines of the same configuration that are fitted
+    differently (e.g. by stagefit.StagedFitter) from those of get_vectorizer.
+    Pipelines with float64 vectors keep the keys they had before the dtype
+    was configurable.
+    """
+    dtype_name = "" if np.dtype(dtype) == np.float64 else np.dtype(dtype).name
+    return hashlib.sha256((str(CACHE_VERSION) + repr(tuple(config)) + digest + library_versions() + variant + dtype_name).encode("utf-8")).hexdigest()
+
+
+@contextmanager
+def _locked(path: str):
+    # Exclusive lock across processes, released when the with block ends (or the process dies)
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _size(path: str) -> int:
+    return sum( os.path.getsize(os.path.join(parent, name)) for (parent, dirs, names) in os.walk(path) for name in names )
+
+
+def _load(path: str):
+    try:
+        vect = joblib.load(os.path.join(path, "pipeline.joblib"), mmap_mode="r")
+    except (OSError, EOFError):
+        # Evicted by another process in the meantime
+        return None
+    # The modification time of an entry is its last use
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return vect
+
+
+def evict(directory: str = CACHE_DIR, max_bytes: int = MAX_BYTES, keep: Optional[str] = None):
+    """Removes the least recently used pipelines (except keep) until the cache takes at most max_bytes."""
+    with _locked(os.path.join(directory, ".lock")):
+        entries = list()
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if os.path.isfile(os.path.join(path, "meta.json")):
+                entries.append((os.path.getmtime(path), _size(path), path))
+        total = sum( size for (mtime, size, path) in entries )
+        for (mtime, size, path) in sorted(entries):
+            if total <= max_bytes:
+                break
+            if path == keep:
+                continue
+            # Pipelines that are already memory-mapped by other processes stay valid after unlinking
+            trash = tempfile.mkdtemp(dir=directory, prefix=".evict-")
+            os.rename(path, os.path.join(trash, "entry"))
+            shutil.rmtree(trash, ignore_errors=True)
+            total -= size
+
+
+def get_vectorizer(dataset: corpus.CorpusSource, *config, n_jobs: int = 1, directory: str = CACHE_DIR, max_bytes: int = MAX_BYTES,
+        fit: Optional[Callable[..., Any]] = None, variant: str = "", dtype=np.float64):
+    """Like vectorizer.get_vectorizer(dataset, *config, n_jobs=n_jobs, dtype=dtype), but loads the fitted pipeline from the cache if possible.
+
+    Pipelines are fitted by fit (with the arguments of
+    vectorizer.get_vectorizer, which is the default) and cached under
+    variant, which must tell apart fits that differ from the default one.
+
+    Pipelines are stored with joblib, and their arrays are memory-mapped
+    read-only when they are loaded, so processes that use the same pipeline
+    share its pages. Only one process fits a pipeline at a time; the others
+    wait for it and load its result. Entries appear atomically and the least
+    recently used ones are evicted when the cache grows beyond max_bytes.
+    """
+    os.makedirs(directory, exist_ok=True)
+    key = fingerprint(config, dataset.digest(), variant, dtype)
+    path = os.path.join(directory, key)
+    if os.path.isfile(os.path.join(path, "meta.json")):
+        vect = _load(path)
+        if vect is not None:
+            return vectorizer.parallelize(vect, n_jobs)
+
+    with _locked(os.path.join(directory, "." + key + ".lock")):
+        # Another process may have fitted it while this one was waiting
+        if os.path.isfile(os.path.join(path, "meta.json")):
+            vect = _load(path)
+            if vect is not None:
+                return vectorizer.parallelize(vect, n_jobs)
+
+        start = time.time()
+        vect = (fit or vectorizer.get_vectorizer)(dataset, *config, n_jobs=n_jobs, dtype=dtype)
+        fitted = vect.transformer if isinstance(vect, partransform.ParallelTransformer) else vect
+        tmp = tempfile.mkdtemp(dir=directory, prefix=".tmp-")
+        try:
+            joblib.dump(fitted, os.path.join(tmp, "pipeline.joblib"))
+            with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+                json.dump({ "version": CACHE_VERSION, "config": repr(tuple(config)), "variant": variant, "dtype": np.dtype(dtype).name, "digest": dataset.digest(),
+                    "libraries": library_versions(), "fit_seconds": time.time() - start }, f)
+            os.rename(tmp, path)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+            if not os.path.isdir(path):
+                raise
+    evict(directory, max_bytes, path)
+    return vect
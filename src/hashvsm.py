@@ -0,0 +1,115 @@
+import os
+
+from multiprocessing import Pool, current_process
+
+import numpy as np
+from scipy.sparse import csr_matrix, vstack
+
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.feature_extraction import FeatureHasher
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.preprocessing import normalize
+
+import partransform
+import ppmi
+
+N_FEATURES = 2 ** 20
+CHUNK_SIZE = 4096
+
+
+def _count(task):
+    (hv, docs) = task
+    return hv.transform(docs)
+
+
+class HashedVectorizer(BaseEstimator, TransformerMixin):
+    """A tf-idf or PPMI vectorizer over terms hashed into n_features buckets, compatible with scikit-learn.
+
+    Instead of a vocabulary, it only keeps one count and one document
+    frequency per bucket, so its size does not depend on the corpus and the
+    documents can be counted on n_jobs processes in chunks of chunk_size. As
+    with TfidfVectorizer, max_df drops buckets that occur in more than that
+    fraction of the documents.
+
+    weighting is "tfidf" (smoothed idf, l2-normalized like TfidfVectorizer)
+    or "ppmi" (with the context distribution smoothing alpha, like
+    PPMIVectorizer). The remaining arguments are those of HashingVectorizer.
+    """
+
+    def __init__(self, weighting="tfidf", alpha=1.0, n_features=N_FEATURES, max_df=1.0, n_jobs=1, chunk_size=CHUNK_SIZE, dtype=np.float64, **kwargs):
+        if weighting not in ["tfidf", "ppmi"]:
+            raise Exception("Unknown weighting: " + weighting)
+        self.__hv = HashingVectorizer(n_features=n_features, alternate_sign=False, norm=None, **kwargs)
+        self.__weighting = weighting
+        self.__alpha = alpha
+        self.__max_df = max_df
+        self.__n_jobs = n_jobs if n_jobs > 0 else os.cpu_count()
+        self.__chunk_size = chunk_size
+        self.__dtype = dtype
+        self.__keep = None
+        self.__col_weights = None
+        self.__total_sum = None
+
+    def fit(self, X, y=None, **fit_params):
+        self.__fit(self.__counts(X))
+        return self
+
+    def fit_transform_counts(self, counts, terms):
+        """Fits on the term-document counts of a corpus (e.g. by tokens.TokenView.counts()) and returns its vectors.
+
+        Every term is hashed once, and the counts are summed into its bucket.
+        """
+        hasher = FeatureHasher(n_features=self.__hv.n_features, input_type="string", alternate_sign=False)
+        buckets = hasher.transform([ [term] for term in terms ]).tocsr()
+        hashed = (counts @ buckets).tocsr()
+        hashed.sort_indices()
+        self.__fit([hashed])
+        return self.__weigh(hashed)
+
+    def transform(self, X, y=None, **fit_params):
+        blocks = [ self.__weigh(counts) for counts in self.__counts(X) ]
+        if len(blocks) == 0:
+            return csr_matrix((0, self.__hv.n_features), dtype=self.__dtype)
+        return vstack(blocks, format="csr")
+
+    def fit_transform(self, X, y=None, **fit_params):
+        self.fit(X)
+        return self.transform(X)
+
+    def __fit(self, blocks):
+        n_features = self.__hv.n_features
+        col_counts = np.zeros(n_features)
+        doc_freqs = np.zeros(n_features, dtype=np.int64)
+        n_docs = 0
+        for counts in blocks:
+            col_counts += np.asarray(counts.sum(0)).ravel()
+            doc_freqs += np.bincount(counts.indices, minlength=n_features)
+            n_docs += counts.shape[0]
+
+        self.__keep = doc_freqs <= self.__max_df * n_docs
+        if self.__weighting == "tfidf":
+            # Smoothed idf as in TfidfTransformer
+            self.__col_weights = np.log((1.0 + n_docs) / (1.0 + doc_freqs)) + 1.0
+        else:
+            col_counts[~self.__keep] = 0.0
+            self.__col_weights = col_counts if self.__alpha == 1.0 else np.power(col_counts, self.__alpha)
+            self.__total_sum = self.__col_weights.sum()
+
+    def __counts(self, X):
+        # Hashed counts of consecutive chunks of X, in order
+        chunks = ( (self.__hv, chunk) for chunk in partransform.iter_chunks(X, self.__chunk_size) )
+        if self.__n_jobs == 1 or current_process().daemon:
+            yield from map(_count, chunks)
+        else:
+            with Pool(self.__n_jobs) as pool:
+                yield from pool.imap(_count, chunks)
+
+    def __weigh(self, counts):
+        if not self.__keep.all():
+            counts.data[~self.__keep[counts.indices]] = 0.0
+            counts.eliminate_zeros()
+        if self.__weighting == "ppmi":
+            return ppmi.ppmi_weights(counts, self.__col_weights, self.__total_sum, self.__dtype)
+        counts = counts.astype(self.__dtype)
+        counts.data *= self.__col_weights[counts.indices]
+        return normalize(counts, copy=False)
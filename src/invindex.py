@@ -0,0 +1,89 @@
+import numpy as np
+from scipy.sparse import csr_matrix, isspmatrix
+
+
+class InvertedIndex:
+    """An inverted term -> method index over normalized, non-negative sparse vectors.
+
+    Probing the index with a block of (normalized) query vectors only scores
+    method pairs that share at least one indexed term. For a minimum
+    similarity threshold > 0, the index applies prefix filtering: the terms of
+    each indexed vector are ordered by decreasing document frequency, and the
+    longest prefix whose maximal contribution to any similarity stays below
+    the threshold is not indexed. A pair can then only reach the threshold if
+    it shares an indexed term, and candidates whose partial score plus the
+    bound of the unindexed prefix cannot reach the threshold are dropped before
+    they are verified.
+
+    The bound of a prefix is its L2 norm (Cauchy-Schwarz) and, if the maximal
+    weight of every term over all query vectors is given, also the sum of its
+    weights times these maximal weights.
+    """
+
+    def __init__(self, X, threshold: float = 0.0, maxweights=None):
+        if not isspmatrix(X):
+            raise ValueError("InvertedIndex requires a sparse matrix")
+        X = csr_matrix(X)
+        if X.nnz > 0 and X.data.min() < 0.0:
+            raise ValueError("InvertedIndex requires non-negative vectors")
+        self.__threshold = threshold
+        if threshold <= 0.0:
+            indexed = X
+            self.__rest = None
+            self.__bounds = np.zeros(X.shape[0])
+        else:
+            (prefix, self.__bounds) = self.__prefixes(X, threshold, maxweights)
+            # The vectors keep their dtype (e.g. float32)
+            zero = X.dtype.type(0)
+            indexed = csr_matrix((np.where(prefix, zero, X.data), X.indices, X.indptr), shape=X.shape, copy=True)
+            indexed.eliminate_zeros()
+            self.__rest = csr_matrix((np.where(prefix, X.data, zero), X.indices, X.indptr), shape=X.shape, copy=True)
+            self.__rest.eliminate_zeros()
+        # One row (posting list) per term
+        self.__postings = indexed.T.tocsr()
+
+    @staticmethod
+    def __prefixes(X, threshold, maxweights):
+        """Marks the entries of X in the unindexed prefix of their row and returns the bound of each row's prefix."""
+        rows = np.repeat(np.arange(X.shape[0]), np.diff(X.indptr))
+        df = np.bincount(X.indices, minlength=X.shape[1])
+        rank = np.empty(X.shape[1], dtype=np.int64)
+        rank[np.argsort(-df, kind="mergesort")] = np.arange(X.shape[1])
+        order = np.lexsort((rank[X.indices], rows))
+
+        def row_cumsum(values):
+            total = np.cumsum(values)
+            offsets = np.concatenate(([0.0], total))[X.indptr[:-1]]
+            return total - np.repeat(offsets, np.diff(X.indptr))
+
+        # Bounds in float64 whatever the dtype of the vectors, so rounding does not drop pairs at the threshold
+        values = X.data[order].astype(np.float64)
+        bound = np.sqrt(row_cumsum(values * values))
+        if maxweights is not None:
+            bound = np.minimum(bound, row_cumsum(values * np.asarray(maxweights).ravel()[X.indices[order]]))
+        inprefix = bound < threshold
+        prefix = np.zeros(X.nnz, dtype=bool)
+        prefix[order] = inprefix
+        bounds = np.zeros(X.shape[0])
+        if X.nnz > 0:
+            # The bound is non-decreasing within a row, so the prefix bound is its maximum
+            np.maximum.at(bounds, rows[order][inprefix], bound[inprefix])
+        return (prefix, bounds)
+
+    def candidates(self, Q):
+        """Returns (rows, cols, partial) of all candidate pairs of query rows and indexed vectors."""
+        partial = (csr_matrix(Q) * self.__postings).tocoo()
+        mask = partial.data + self.__bounds[partial.col] >= self.__threshold
+        if self.__threshold <= 0.0:
+            mask &= partial.data > 0.0
+        return (partial.row[mask], partial.col[mask], partial.data[mask])
+
+    def pairs(self, Q):
+        """Returns (rows, cols, sims) of all pairs of query rows and indexed vectors with sim > 0 and sim >= threshold."""
+        (rows, cols, sims) = self.candidates(Q)
+        if self.__rest is not None and len(rows) > 0:
+            Q = csr_matrix(Q)
+            sims = sims + np.asarray(Q[rows].multiply(self.__rest[cols]).sum(1)).ravel()
+            mask = sims >= self.__threshold
+            (rows, cols, sims) = (rows[mask], cols[mask], sims[mask])
+        return (rows, cols, sims)
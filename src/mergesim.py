@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+# Merges the shard databases written by "calcsim.py --shard i/N --output ..."
+# into internal_methodsim of docs.db.
+
+import argparse
+import sqlite3
+import sys
+
+import simwriter
+
+
+parser = argparse.ArgumentParser(description="Merges calcsim.py shard databases into docs.db")
+parser.add_argument("shards", nargs="+", help="shard databases written by calcsim.py --shard")
+parser.add_argument("--late-index", action="store_true",
+    help="create internal_methodsim without primary key and build its unique index after all pairs are inserted")
+args = parser.parse_args()
+
+
+# Validate the shards before touching docs.db
+specs = list()
+for path in args.shards:
+    sconn = sqlite3.connect("file:" + path + "?mode=ro", uri=True)
+    try:
+        (shard, shards, block_size, store, units) = sconn.execute(
+            '''SELECT shard, shards, block_size, store, units FROM internal_methodsim_shard''').fetchone()
+        done = int(sconn.execute('''SELECT count(*) FROM internal_methodsim_progress''').fetchone()[0])
+        settings = tuple(sconn.execute('''SELECT block_size, store, min_sim, both_orders, dtype FROM internal_methodsim_settings''').fetchone())
+    except (sqlite3.DatabaseError, TypeError):
+        print("[E] " + path + " is not a calcsim.py shard database", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        sconn.close()
+    if done != units:
+        print("[E] " + path + " is incomplete (" + str(done) + " of " + str(units) + " units), resume it first", file=sys.stderr)
+        sys.exit(1)
+    specs.append((path, shard, shards, block_size, store, settings))
+
+if len(set( spec[2:] for spec in specs )) != 1:
+    print("[E] shards were computed with different shard counts, block sizes, vector stores or flags", file=sys.stderr)
+    sys.exit(1)
+if sorted( spec[1] for spec in specs ) != list(range(specs[0][2])):
+    print("[E] expected exactly the shards 0 to " + str(specs[0][2] - 1), file=sys.stderr)
+    sys.exit(1)
+block_size = specs[0][3]
+settings = specs[0][5]
+
+conn = sqlite3.connect("./docs.db", isolation_level=None)
+for pragma in simwriter.PRAGMAS:
+    conn.execute(pragma)
+simwriter.create_tables(conn, not args.late_index)
+if conn.execute('''SELECT count(*) FROM (SELECT 1 FROM internal_methodsim LIMIT 1)''').fetchone()[0] > 0:
+    print("[E] internal_methodsim in docs.db is not empty", file=sys.stderr)
+    sys.exit(1)
+# The merged journal can be resumed like that of an unsharded run
+conn.execute('''DELETE FROM internal_methodsim_settings''')
+conn.execute('''INSERT INTO internal_methodsim_settings VALUES (?, ?, ?, ?, ?)''', settings)
+
+# Bulk-load each shard in one transaction, including its progress journal
+total = 0
+for (path, shard, shards, block_size, store, settings) in sorted(specs, key=lambda spec: spec[1]):
+    conn.execute("ATTACH DATABASE ? AS shard", (path, ))
+    conn.execute("BEGIN")
+    conn.execute('''INSERT INTO internal_methodsim
+            SELECT first_id, second_id, sim_cs, sim_tok FROM shard.internal_methodsim ORDER BY first_id, second_id''')
+    conn.execute('''INSERT INTO internal_methodsim_progress
+            SELECT block1, block2, block_size FROM shard.internal_methodsim_progress''')
+    conn.execute("COMMIT")
+    rows = int(conn.execute('''SELECT count(*) FROM shard.internal_methodsim''').fetchone()[0])
+    conn.execute("DETACH DATABASE shard")
+    total += rows
+    print("Merged shard " + str(shard) + "/" + str(shards) + " (" + str(rows) + " rows)")
+    sys.stdout.flush()
+
+# A unique index fails on pairs that were computed by more than one shard
+simwriter.create_index(conn)
+if int(conn.execute('''SELECT count(*) FROM internal_methodsim''').fetchone()[0]) != total:
+    print("[E] row count of internal_methodsim does not match the shards", file=sys.stderr)
+    sys.exit(1)
+conn.close()
+print("Merged " + str(total) + " rows")
@@ -0,0 +1,55 @@
+import csv
+import sqlite3
+
+from typing import *
+
+import numpy as np
+
+
+def get_filename(classname: str) -> str:
+    """The source file of a class, e.g. Foo.java for Foo.Bar."""
+    dotpos = classname.find(".")
+    if dotpos < 0:
+        return classname + ".java"
+    return classname[:dotpos] + ".java"
+
+
+def load_samples(db_path: str, sample_path: str) -> List[Tuple[int, int, str, str, float]]:
+    """(id1, id2, kwset1, kwset2, cat) of the classified method pairs of a CSV file (e.g. sampled-pairs.csv or simopt.in).
+
+    The methods are looked up by project, class and method in the database.
+    Raises an exception for methods that are not in it, after printing them.
+    """
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
+    samples = list()
+    with open(sample_path, "r", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            methods = list()
+            for i in ["1", "2"]:
+                c.execute("""SELECT d.id, kwset
+                        FROM internal_filtered_methoddocs d JOIN projects p ON d.project_id = p.id
+                        WHERE p.name = ? AND d.file like ? AND method = ?""",
+                    (row["project" + i], "%/" + get_filename(row["class" + i]), row["class" + i] + "." + row["method" + i]))
+                method = c.fetchone()
+                if method is None:
+                    print(row["project" + i] + ":" + row["class" + i] + "#" + row["method" + i])
+                    conn.close()
+                    raise Exception("Unknown method in " + sample_path)
+                methods.append(method)
+            samples.append((methods[0][0], methods[1][0], methods[0][1], methods[1][1], float(row["cat"])))
+    conn.close()
+    return samples
+
+
+def quality(sims: np.ndarray, cats: np.ndarray) -> Tuple[float, float]:
+    """The SSE of the similarities of the sample pairs against their categories, and the precision of the pairs with sim > 0.8.
+
+    Pairs with cat >= 0.5 are similar, pairs of other categories count as
+    false positives from sim >= 0.2 on. These are the qualities of
+    exhaustive_opt and pso_opt in simopt.py.
+    """
+    sse = float(((sims - cats) ** 2).sum())
+    tp = int(((cats >= 0.5) & (sims > 0.8)).sum())
+    fp = int(((cats < 0.5) & (sims >= 0.2)).sum())
+    return (sse, float(tp) / (tp + fp) if tp + fp > 0 else 0.0)
@@ -0,0 +1,112 @@
+import os
+
+from collections import deque
+from itertools import chain, islice
+from multiprocessing import Pool, current_process
+
+import numpy as np
+from scipy.sparse import isspmatrix, vstack
+
+from sklearn.base import BaseEstimator, TransformerMixin
+
+MIN_CHUNK_SIZE = 256
+MAX_CHUNK_SIZE = 16384
+CHUNKS_PER_JOB = 4
+
+
+def _init_worker(worker_transformer):
+    # With fork, the fitted transformer is inherited instead of pickled for every chunk
+    global transformer
+    transformer = worker_transformer
+
+
+def iter_chunks(X, size):
+    """The documents of X in lists of size documents (the last one may be shorter)."""
+    it = iter(X)
+    while True:
+        chunk = list(islice(it, size))
+        if len(chunk) == 0:
+            return
+        yield chunk
+
+
+def _transform(chunk):
+    return transformer.transform(np.asarray(chunk))
+
+
+def chunk_size(n_docs: int, n_jobs: int) -> int:
+    """About CHUNKS_PER_JOB chunks per process, so processes are evenly loaded, but not so small that the overhead per chunk dominates."""
+    size = -(-n_docs // (n_jobs * CHUNKS_PER_JOB))
+    return max(MIN_CHUNK_SIZE, min(MAX_CHUNK_SIZE, size))
+
+
+class ParallelTransformer(BaseEstimator, TransformerMixin):
+    """Transforms with a fitted transformer (e.g. a pipeline of get_vectorizer) on n_jobs processes.
+
+    transform() splits the documents into chunks, transforms them on a
+    process pool and stacks the sparse or dense results in order. Inputs that
+    fit into a single chunk are transformed in this process. The chunk size is
+    derived from the number of documents unless it is given. The pool is
+    started on first use and kept until close() or until the transformer is
+    garbage collected; it is not pickled.
+
+    Each document is transformed independently, so the result is the same as
+    transformer.transform() on all documents (for NMF, up to the tolerance of
+    its solver, which is checked per chunk).
+    """
+
+    def __init__(self, transformer, n_jobs=-1, chunk_size=None):
+        self.transformer = transformer
+        self.n_jobs = n_jobs
+        self.chunk_size = chunk_size
+        self.__pool = None
+
+    def fit(self, X, y=None, **fit_params):
+        self.close()
+        self.transformer.fit(X)
+        return self
+
+    def transform(self, X, y=None, **fit_params):
+        n_jobs = self.n_jobs if self.n_jobs > 0 else os.cpu_count()
+        size = self.chunk_size
+        if size is None:
+            # Streams of unknown length get the largest chunks
+            size = chunk_size(len(X), n_jobs) if hasattr(X, "__len__") else MAX_CHUNK_SIZE
+        chunks = iter_chunks(X, size)
+        first = next(chunks, [])
+        second = next(chunks, None)
+        # Daemonic processes (e.g. pool workers) cannot start a pool of their own
+        if n_jobs == 1 or second is None or current_process().daemon:
+            results = [ self.transformer.transform(np.asarray(chunk)) for chunk in chain([first], [] if second is None else [second], chunks) ]
+        else:
+            if self.__pool is None:
+                self.__pool = Pool(n_jobs, initializer=_init_worker, initargs=(self.transformer, ))
+            # Chunks are read here rather than by the pool's feeder thread (streams from SQLite are bound to
+            # their thread), and at most two per process are in flight
+            results = list()
+            pending = deque()
+            for chunk in chain([first, second], chunks):
+                pending.append(self.__pool.apply_async(_transform, (chunk, )))
+                if len(pending) >= 2 * n_jobs:
+                    results.append(pending.popleft().get())
+            results.extend( result.get() for result in pending )
+        if isspmatrix(results[0]):
+            return vstack(results, format="csr")
+        return np.vstack(results)
+
+    def close(self):
+        """Stops the process pool."""
+        if self.__pool is not None:
+            self.__pool.close()
+            self.__pool.join()
+            self.__pool = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_ParallelTransformer__pool"] = None
+        return state
+
+    def __del__(self):
+        if self.__pool is not None:
+            self.__pool.terminate()
+
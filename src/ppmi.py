@@ -1,40 +1,197 @@
-from math import log
-
 import numpy as np
-from scipy.sparse import coo_matrix, find
+from scipy.sparse import csr_matrix
 
 from sklearn.base import BaseEstimator, TransformerMixin
 from sklearn.feature_extraction.text import CountVectorizer
 
+import tokens
+
+
+def ppmi_weights(matrix, col_sums, total_sum, dtype=np.float64):
+    """Returns max(0, log(total * count / (row sum * column sum))) for all non-zero counts of a CSR count matrix.
+
+    The weights are computed on the data array of the count matrix, and the
+    result shares its indices and indptr arrays.
+    """
+    row_sums = np.asarray(matrix.sum(1)).ravel()
+    col_sums = np.asarray(col_sums).ravel()
+    # Same order of operations as total * V / (row sum * column sum) per entry
+    data = matrix.data.astype(dtype)
+    data *= total_sum
+    denominators = np.repeat(row_sums.astype(dtype), np.diff(matrix.indptr))
+    denominators *= col_sums[matrix.indices]
+    data /= denominators
+    del denominators
+    np.maximum(data, 1, out=data)
+    np.log(data, out=data)
+    return csr_matrix((data, matrix.indices, matrix.indptr), shape=matrix.shape)
+
+
 class PPMIVectorizer(BaseEstimator, TransformerMixin):
-    """A PPMI vectorizer that is compatible with scikit-learn."""
+    """A PPMI vectorizer that is compatible with scikit-learn.
+
+    With incremental=True, it keeps the counts and document frequencies of
+    all terms it has seen besides the column sums of the vocabulary
+    (including terms dropped by max_df, min_df or max_features), so
+    partial_fit() can add documents later with the same result as fitting on
+    all documents at once, apart from the order of the columns. Otherwise
+    they are released after fitting, so they are neither kept in memory nor
+    pickled along with the vectorizer.
+    """
 
-    def __init__(self, alpha=1.0, **kwargs):
-        self.__cv = CountVectorizer(**kwargs)
+    def __init__(self, alpha=1.0, dtype=np.float64, incremental=False, **kwargs):
+        self.__max_df = kwargs.pop("max_df", 1.0)
+        self.__min_df = kwargs.pop("min_df", 1)
+        self.__max_features = kwargs.pop("max_features", None)
+        self.__cv_params = kwargs
+        self.__counter = CountVectorizer(**kwargs)
+        self.__cv = None
         self.__col_sums = None
         self.__total_sum = None
         self.__alpha = alpha
+        self.__dtype = dtype
+        self.__incremental = incremental
+        self.__reset()
 
     def fit(self, X, y=None, **fit_params):
-        c_matrix = self.__cv.fit_transform(X).tocsc()
-        if self.__alpha == 1.0:
-            self.__col_sums = c_matrix.sum(0)
-        else:
-            self.__col_sums = np.power(c_matrix.sum(0), self.__alpha)
-        self.__total_sum = self.__col_sums.sum()
+        self.__reset()
+        self.__count(X)
+        # Alphabetical columns, like CountVectorizer
+        terms = self.__terms
+        order = np.asarray(sorted(range(len(terms)), key=terms.__getitem__), dtype=np.int64)
+        self.__terms = [ terms[i] for i in order.tolist() ]
+        self.__term_counts = self.__term_counts[order]
+        self.__doc_freqs = self.__doc_freqs[order]
+        self.__update()
+        self.__release()
+        return self
+
+    def fit_transform_counts(self, counts, terms):
+        """Fits on the term-document counts of a corpus (e.g. by tokens.TokenView.counts()) and returns its vectors.
+
+        The columns of counts are the given terms in alphabetical order.
+        """
+        self.__reset()
+        self.__terms = list(terms)
+        self.__term_counts = np.asarray(counts.sum(0), dtype=np.int64).ravel()
+        self.__doc_freqs = np.bincount(counts.indices, minlength=len(terms)).astype(np.int64)
+        self.__n_docs = counts.shape[0]
+        self.__update()
+        columns = self.__columns
+        self.__release()
+        return ppmi_weights(counts[:, columns], self.__col_sums, self.__total_sum, self.__dtype)
+
+    def partial_fit(self, X, y=None, **fit_params):
+        """Adds the documents X to the counts, growing the vocabulary.
+
+        Columns of terms that stay in the vocabulary keep their index, new
+        terms are appended. Columns are only removed if max_df, min_df or
+        max_features drop a term that was in the vocabulary before. Requires
+        incremental=True.
+        """
+        if not self.__incremental:
+            raise Exception("PPMIVectorizer without incremental=True cannot add documents")
+        self.__count(X)
+        self.__update()
+        return self
 
     def transform(self, X, y=None, **fit_params):
-        matrix = self.__cv.transform(X)
-        data = np.empty(matrix.getnnz())
-        rowsums = matrix.sum(1)
-        (I, J, V) = find(matrix)
-        for i in range(0, matrix.getnnz()):
-            v = (self.__total_sum * V[i]) / (rowsums[I[i], 0] * self.__col_sums[0, J[i]])
-            data[i] = max(0, log(max(1, v)))
-        return coo_matrix((data, (I, J)), shape=matrix.get_shape()).tocsr()
+        return ppmi_weights(self.__cv.transform(X), self.__col_sums, self.__total_sum, self.__dtype)
 
     def fit_transform(self, X, y=None, **fit_params):
         self.fit(X)
         return self.transform(X)
 
+    def vocabulary(self):
+        """The terms of the columns, in column order."""
+        vocabulary = self.__cv.vocabulary
+        return sorted(vocabulary, key=vocabulary.get)
+
+    def drift(self, before, X):
+        """Returns the cosine distance between the vectors of X under before and under this vectorizer.
+
+        before is a copy of this vectorizer (e.g. by copy.deepcopy()) taken
+        before partial_fit(). Columns are matched by term, so the distance
+        covers both reweighting and terms that entered or left the vocabulary.
+        A distance near 0 for the documents of the existing corpus means that
+        their stored vectors and similarities are still valid.
+        """
+        X = X if isinstance(X, list) else list(X)
+        old = before.transform(X).tocsr()
+        new = self.transform(X).tocsr()
+
+        # Map the old columns to the new ones, terms that were dropped get columns of their own
+        columns = { term: j for (j, term) in enumerate(self.vocabulary()) }
+        old_terms = before.vocabulary()
+        mapping = np.empty(len(old_terms), dtype=np.int64)
+        n_cols = len(columns)
+        for (i, term) in enumerate(old_terms):
+            j = columns.get(term)
+            if j is None:
+                (j, n_cols) = (n_cols, n_cols + 1)
+            mapping[i] = j
+        old = csr_matrix((old.data, mapping[old.indices], old.indptr), shape=(old.shape[0], n_cols))
+        new = csr_matrix((new.data, new.indices, new.indptr), shape=(new.shape[0], n_cols))
+
+        dots = np.asarray(old.multiply(new).sum(1)).ravel()
+        old_norms = np.sqrt(np.asarray(old.multiply(old).sum(1)).ravel())
+        new_norms = np.sqrt(np.asarray(new.multiply(new).sum(1)).ravel())
+        norms = old_norms * new_norms
+        distances = np.where(norms > 0, 1.0 - dots / np.where(norms > 0, norms, 1.0), 0.0)
+        # A vector that became zero (or non-zero) moved completely
+        distances[(old_norms > 0) != (new_norms > 0)] = 1.0
+        return distances
+
+    def __reset(self):
+        self.__terms = list()
+        self.__term_counts = np.zeros(0, dtype=np.int64)
+        self.__doc_freqs = np.zeros(0, dtype=np.int64)
+        self.__n_docs = 0
+        # Term of every column
+        self.__columns = np.zeros(0, dtype=np.int64)
+
+    def __release(self):
+        # The statistics of all terms are only needed by partial_fit()
+        if not self.__incremental:
+            self.__reset()
 
+    def __count(self, X):
+        # Term counts and document frequencies of all terms, in order of appearance
+        analyze = self.__counter.build_analyzer()
+        terms = { term: j for (j, term) in enumerate(self.__terms) }
+        term_counts = self.__term_counts.tolist()
+        doc_freqs = self.__doc_freqs.tolist()
+        for doc in X:
+            self.__n_docs += 1
+            doc_counts = dict()
+            for feature in analyze(doc):
+                doc_counts[feature] = doc_counts.get(feature, 0) + 1
+            for (feature, count) in doc_counts.items():
+                j = terms.get(feature)
+                if j is None:
+                    j = terms[feature] = len(term_counts)
+                    term_counts.append(0)
+                    doc_freqs.append(0)
+                term_counts[j] += count
+                doc_freqs[j] += 1
+        self.__terms = sorted(terms, key=terms.get)
+        self.__term_counts = np.asarray(term_counts, dtype=np.int64)
+        self.__doc_freqs = np.asarray(doc_freqs, dtype=np.int64)
+
+    def __update(self):
+        # Select the vocabulary like CountVectorizer._limit_features()
+        term_counts = self.__term_counts
+        mask = tokens.limit_terms(term_counts, self.__doc_freqs, self.__n_docs, self.__max_df, self.__min_df, self.__max_features)
+
+        # Terms already in the vocabulary keep their order, new terms are appended
+        kept = self.__columns[mask[self.__columns]]
+        added = np.where(mask)[0]
+        self.__columns = np.concatenate([ kept, added[~np.isin(added, kept)] ]).astype(np.int64)
+
+        if self.__alpha == 1.0:
+            self.__col_sums = term_counts[self.__columns]
+        else:
+            self.__col_sums = np.power(term_counts[self.__columns], self.__alpha)
+        self.__total_sum = self.__col_sums.sum()
+        # The vocabulary shares the term strings with the term list (also when pickled)
+        self.__cv = CountVectorizer(vocabulary={ self.__terms[i]: j for (j, i) in enumerate(self.__columns.tolist()) }, **self.__cv_params)
@@ -1,4 +1,7 @@
 from math import tanh
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+import os
 import random
 import time
 
@@ -28,18 +31,29 @@ class Particle:
     def _setbestpos(self):
         self.__bestpos = list(self.__position)
 
-    def _update(self, damping, localfactor, globalfactor, globalbest, low, high):
+    def _update(self, damping, localfactor, globalfactor, globalbest, low, high, rng=random):
         for i in range(0, len(self.__velocity)):
             self.__velocity[i] = damping * (self.__velocity[i] +
-                localfactor * random.uniform(0, 1) * (self.__bestpos[i] - self.__position[i]) +
-                globalfactor * random.uniform(0, 1) * (globalbest[i] - self.__position[i]))
+                localfactor * rng.uniform(0, 1) * (self.__bestpos[i] - self.__position[i]) +
+                globalfactor * rng.uniform(0, 1) * (globalbest[i] - self.__position[i]))
             self.__position[i] = self.__position[i] + self.__velocity[i]
 
 
 
 class ParticleSwarmOptimizer:
-    def __init__(self, quality, terminate, low, high, damping, localfactor, globalfactor, bestselector):
+    """Synchronous particle swarm optimization.
+
+    In every iteration, all particles move based on the best positions of
+    the previous iteration, then their new positions are evaluated as one
+    batch by prefetch (if given, e.g. CacheQuality.prefetch() on a pool),
+    and only then the best positions are updated. So the result only depends
+    on seed, not on how the batch is evaluated.
+    """
+
+    def __init__(self, quality, terminate, low, high, damping, localfactor, globalfactor, bestselector, prefetch=None, seed=None):
         self.__quality = quality
+        self.__prefetch = prefetch
+        self.__rng = random.Random(seed)
         self.__terminate = terminate
         self.__low = low
         self.__high = high
@@ -51,12 +65,12 @@ class ParticleSwarmOptimizer:
 
     def __random(self, low, high):
         assert len(low) == len(high)
-        result = Particle([ random.uniform(low[i], high[i]) for i in range(len(low)) ],
-            [ random.triangular(-2 * abs(high[i] - low[i]), 2 * abs(high[i] - low[i]))
+        result = Particle([ self.__rng.uniform(low[i], high[i]) for i in range(len(low)) ],
+            [ self.__rng.triangular(-2 * abs(high[i] - low[i]), 2 * abs(high[i] - low[i]))
                 for i in range(len(low)) ])
         # Move a random component to the boundary of the search space
-        compn = random.randrange(len(low))
-        if random.choice((True, False)):
+        compn = self.__rng.randrange(len(low))
+        if self.__rng.choice((True, False)):
             result._getpos()[compn] = low[compn]
             result._getvel()[compn] = abs(result._getvel()[compn])
         else:
@@ -65,28 +79,40 @@ class ParticleSwarmOptimizer:
         return result
 
 
+    def __inside(self, pos):
+        return all( self.__low[i] <= pos[i] <= self.__high[i] for i in range(len(pos)) )
+
     def _eval_quality(self, pos):
-        if any( pos[i] < self.__low[i] or pos[i] > self.__high[i] for i in range(len(pos)) ):
+        if not self.__inside(pos):
             return float("-inf")
         return self.__quality(pos)
 
+    def _eval_batch(self, particles):
+        # Evaluates the positions of all particles at once, the quality function then reads them from its cache
+        if self.__prefetch is not None:
+            self.__prefetch([ list(p._getpos()) for p in particles if self.__inside(p._getpos()) ])
+
 
     def optimize(self, n):
         if isinstance(n, int):
             return self._optimize([ self.__random(self.__low, self.__high) for i in range(0, n) ])
         return self._optimize([ Particle(pos, 
-            [ random.triangular(-2 * abs(self.__high[i] - self.__low[i]),
+            [ self.__rng.triangular(-2 * abs(self.__high[i] - self.__low[i]),
                     2 * abs(self.__high[i] - self.__low[i]))
                 for i in range(0, len(self.__low)) ])
             for pos in n ])
 
     def _optimize(self, particles):
+        self._eval_batch(particles)
         best = self.__bestselector(particles, self._eval_quality)
         while not self.__terminate(best.result(), self._eval_quality(best.result())):
             start = time.time()
-            i = 0
+            # All particles move towards the best positions of the last iteration
+            bests = [ list(best.bestfor(p)) for p in particles ]
+            for (p, pbest) in zip(particles, bests):
+                p._update(self.__damping, self.__localfactor, self.__globalfactor, pbest, self.__low, self.__high, self.__rng)
+            self._eval_batch(particles)
             for p in particles:
-                p._update(self.__damping, self.__localfactor, self.__globalfactor, best.bestfor(p), self.__low, self.__high)
                 if best.isimprovement(p):
                     p._setbestpos()
                     best.update(p)
@@ -99,10 +125,12 @@ class ParticleSwarmOptimizer:
 
 
 class ParticleSwarmAdapter:
-    def __init__(self, cls, features, quality, terminate, damping, localfactor, globalfactor, bestselector):
+    def __init__(self, cls, features, quality, terminate, damping, localfactor, globalfactor, bestselector, seed=None):
         self.__init_features(features)
+        # Qualities that evaluate batches (like CacheQuality) get all positions of an iteration at once
+        prefetch = self.__prefetch if hasattr(quality, "prefetch") else None
         self.__opt = cls(self.__qadapt, terminate, self.__low, self.__high,
-            damping, localfactor, globalfactor, bestselector)
+            damping, localfactor, globalfactor, bestselector, prefetch, seed)
         self.__quality = quality
 
 
@@ -130,6 +158,10 @@ class ParticleSwarmAdapter:
         return self.__quality([ self.__getf(vec[i], i) for i in range(0, len(vec)) ])
 
 
+    def __prefetch(self, vecs):
+        self.__quality.prefetch([ [ self.__getf(vec[i], i) for i in range(0, len(vec)) ] for vec in vecs ])
+
+
     def optimize(self, n):
         vec = self.__opt.optimize(n)
         return [ self.__getf(vec[i], i) for i in range(0, len(vec)) ]
@@ -271,10 +303,54 @@ class StretchingAdapter:
         return self.__delegate.result()
 
 
+_worker_fun = None
+
+def _init_worker(fun):
+    # Pool workers get the quality function when they start (forked, so it need not be picklable)
+    global _worker_fun
+    _worker_fun = fun
+
+
+def _evaluate(arg):
+    return _worker_fun(arg)
+
+
 class CacheQuality:
-    def __init__(self, fun):
+    """Caches the quality of every argument (e.g. a configuration) it has been called with.
+
+    prefetch() evaluates a batch of arguments, each distinct argument that is
+    not cached yet only once, on a pool of n_jobs processes (all cores for
+    -1), or threads with threads=True. The pool is started on first use and
+    kept until close().
+    """
+
+    def __init__(self, fun, n_jobs=1, threads=False):
         self.__cache = dict()
         self.__fun = fun
+        self.__n_jobs = n_jobs if n_jobs > 0 else os.cpu_count()
+        self.__threads = threads
+        self.__pool = None
+
+    def prefetch(self, args):
+        todo = list()
+        for arg in args:
+            tp = tuple(arg)
+            if tp not in self.__cache and tp not in todo:
+                todo.append(tp)
+        if self.__n_jobs == 1 or len(todo) <= 1:
+            values = [ self.__fun(list(tp)) for tp in todo ]
+        else:
+            if self.__pool is None:
+                self.__pool = (ThreadPool if self.__threads else Pool)(self.__n_jobs, initializer=_init_worker, initargs=(self.__fun, ))
+            values = self.__pool.map(_evaluate, [ list(tp) for tp in todo ], chunksize=1)
+        self.__cache.update(zip(todo, values))
+
+    def close(self):
+        """Stops the pool."""
+        if self.__pool is not None:
+            self.__pool.close()
+            self.__pool.join()
+            self.__pool = None
 
     def __call__(self, arg):
         tp = tuple(arg)
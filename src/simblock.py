@@ -0,0 +1,117 @@
+from typing import *
+
+import numpy as np
+from scipy.sparse import csr_matrix, isspmatrix
+
+from sklearn.preprocessing import normalize
+
+
+def blocks(n: int, size: int):
+    """Yields the (start, stop) row ranges of consecutive blocks of at most size rows."""
+    for start in range(0, n, size):
+        yield (start, min(start + size, n))
+
+
+def balanced_blocks(weights, size: int) -> List[Tuple[int, int]]:
+    """Splits rows into as many consecutive blocks as blocks() would, but with about the same total weight each.
+
+    With the number of non-zeros of each row as weight, all blocks of a sparse
+    matrix cost about the same to multiply, however unevenly the vectors of
+    different projects are populated.
+    """
+    n = len(weights)
+    if n == 0:
+        return []
+    n_blocks = (n + size - 1) // size
+    cum = np.cumsum(np.asarray(weights, dtype=np.float64))
+    cuts = np.searchsorted(cum, cum[-1] * np.arange(1, n_blocks) / n_blocks, side="left") + 1
+    bounds = np.unique(np.concatenate(([0], cuts, [n])))
+    return [ (int(bounds[i]), int(bounds[i + 1])) for i in range(len(bounds) - 1) ]
+
+
+def triangle(n_blocks: int) -> List[Tuple[int, int]]:
+    """All blocks (i, j) with i <= j of a symmetric matrix of n_blocks x n_blocks blocks, row by row."""
+    return [ (i, j) for i in range(n_blocks) for j in range(i, n_blocks) ]
+
+
+def normalize_rows(X):
+    """L2-normalizes every row of X, exactly as cosine_similarity does before the dot product."""
+    if isspmatrix(X):
+        return normalize(csr_matrix(X))
+    return normalize(np.asarray(X))
+
+
+def block_sims(A, B):
+    """Cosine similarities of all rows of A to all rows of B (both already normalized).
+
+    Sparse blocks are multiplied sparse-sparse, so only pairs sharing a term are
+    ever materialized. Dense blocks (e.g. LSA output) use a single BLAS product.
+    """
+    if isspmatrix(A) and isspmatrix(B):
+        return A * B.T
+    if isspmatrix(A):
+        A = A.toarray()
+    if isspmatrix(B):
+        B = B.toarray()
+    return np.dot(A, B.T)
+
+
+def pair_sims(X, first, second) -> np.ndarray:
+    """Cosine similarities of the rows first[i] and second[i] of X for every i, like cosine_similarity of each pair.
+
+    The rows are normalized once and the pairs are scored with one row-wise
+    product, sparse for sparse X and dense for dense X.
+    """
+    X = normalize_rows(X)
+    if isspmatrix(X):
+        return np.asarray(X[first].multiply(X[second]).sum(1)).ravel()
+    return np.einsum("ij,ij->i", X[first], X[second])
+
+
+def positive_entries(S, min_sim: float = 0.0):
+    """Returns (rows, cols, sims) of all entries of S with sim > 0 and sim >= min_sim."""
+    if isspmatrix(S):
+        S = S.tocoo()
+        mask = (S.data > 0.0) & (S.data >= min_sim)
+        return (S.row[mask], S.col[mask], S.data[mask])
+    (rows, cols) = np.nonzero((S > 0.0) & (S >= min_sim))
+    return (rows, cols, S[rows, cols])
+
+
+def positive_pairs(S, first_ids, second_ids, min_sim: float = 0.0):
+    """Returns a list of (first_id, second_id, sim) for all entries of S with sim > 0 and sim >= min_sim."""
+    (rows, cols, sims) = positive_entries(S, min_sim)
+    return list(zip(np.asarray(first_ids)[rows].tolist(), np.asarray(second_ids)[cols].tolist(), sims.tolist()))
+
+
+def top_k(S, k: int, exclude=None) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """Returns (cols, sims) of the k largest entries with sim > 0 of every row of S, by decreasing sim.
+
+    exclude optionally gives one column per row that is skipped (e.g. the
+    query method itself), or -1 for none.
+    """
+    results = list()
+    if isspmatrix(S):
+        S = csr_matrix(S)
+        for i in range(S.shape[0]):
+            cols = S.indices[S.indptr[i]:S.indptr[i + 1]]
+            sims = S.data[S.indptr[i]:S.indptr[i + 1]]
+            mask = sims > 0.0
+            if exclude is not None:
+                mask &= cols != exclude[i]
+            (cols, sims) = (cols[mask], sims[mask])
+            order = np.argsort(-sims, kind="mergesort")[:k]
+            results.append((cols[order], sims[order]))
+        return results
+    S = np.array(S)
+    if exclude is not None:
+        rows = np.where(np.asarray(exclude) >= 0)[0]
+        S[rows, np.asarray(exclude)[rows]] = -np.inf
+    k = min(k, S.shape[1])
+    # Only the k largest entries of each row are sorted
+    top = np.argpartition(-S, k - 1, axis=1)[:, :k] if 0 < k < S.shape[1] else np.tile(np.arange(S.shape[1]), (S.shape[0], 1))
+    for i in range(S.shape[0]):
+        cols = top[i][np.argsort(-S[i, top[i]], kind="mergesort")]
+        cols = cols[S[i, cols] > 0.0][:k]
+        results.append((cols, S[i, cols]))
+    return results
@@ -0,0 +1,183 @@
+import json
+import os
+import threading
+import time
+
+from typing import *
+
+import corpus
+
+INTERVAL = 30.0
+PREFIX = "sesame_calcsim_"
+
+
+def rss_mb() -> float:
+    """Current resident set size of this process in MiB (peak RSS where /proc is not available)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1048576.0
+    except (OSError, ValueError):
+        return corpus.peak_rss_mb()
+
+
+class StageTimer:
+    """Accumulates the wall-clock time between consecutive laps per stage, e.g. within one task of a worker."""
+
+    def __init__(self):
+        self.seconds = dict()
+        self.__last = time.perf_counter()
+
+    def lap(self, stage: str):
+        """Adds the time since the last lap (or since construction) to stage."""
+        now = time.perf_counter()
+        self.seconds[stage] = self.seconds.get(stage, 0.0) + now - self.__last
+        self.__last = now
+
+    def stats(self) -> Dict[str, Any]:
+        """Stage times of this task plus the pid and RSS of the process, to be passed to Metrics.add_worker()."""
+        return { "pid": os.getpid(), "rss_mb": rss_mb(), "seconds": self.seconds }
+
+
+class Metrics:
+    """Counters, stage timers and gauges of a long computation, with throughput and ETA.
+
+    Counters and stage times are only added up when a task finishes, and
+    gauges are callables that are sampled when a snapshot is taken, so keeping
+    the metrics costs next to nothing per pair. A background thread takes a
+    snapshot every interval seconds, prints the progress, appends the snapshot
+    to a JSON-lines file and replaces a Prometheus textfile (for the textfile
+    collector of node_exporter) atomically.
+
+    The ETA extrapolates the rate of the "pairs_scored" counter to the
+    remaining pairs of total_pairs.
+    """
+
+    def __init__(self, total_pairs: int, jsonl_path: Optional[str] = None, prom_path: Optional[str] = None, interval: float = INTERVAL):
+        self.total_pairs = total_pairs
+        self.__jsonl_path = jsonl_path
+        self.__prom_path = prom_path
+        self.__interval = interval
+        self.__lock = threading.Lock()
+        self.__counters = dict()
+        self.__seconds = dict()
+        self.__gauges = dict()
+        self.__stages = dict()
+        self.__workers = dict()
+        self.__start = time.time()
+        self.__stopped = threading.Event()
+        self.__thread = None
+
+    def add(self, name: str, value: float = 1):
+        """Increments a counter."""
+        with self.__lock:
+            self.__counters[name] = self.__counters.get(name, 0) + value
+
+    def add_seconds(self, seconds: Dict[str, float]):
+        """Adds time spent per stage."""
+        with self.__lock:
+            for (stage, value) in seconds.items():
+                self.__seconds[stage] = self.__seconds.get(stage, 0.0) + value
+
+    def add_worker(self, stats: Dict[str, Any]):
+        """Adds the stage times of a finished task and records the RSS of the worker that ran it."""
+        self.add_seconds(stats["seconds"])
+        with self.__lock:
+            self.__workers[stats["pid"]] = stats["rss_mb"]
+
+    def gauge(self, name: str, fun: Callable[[], float]):
+        """Registers a value that is sampled by calling fun whenever a snapshot is taken."""
+        self.__gauges[name] = fun
+
+    def stage(self, stage: str, fun: Callable[[], float]):
+        """Registers a stage whose total time is kept elsewhere, e.g. by another thread, and sampled by calling fun."""
+        self.__stages[stage] = fun
+
+    def start(self):
+        self.__start = time.time()
+        self.__thread = threading.Thread(target=self.__run, name="Metrics", daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        """Stops the background thread and writes a final snapshot."""
+        self.__stopped.set()
+        if self.__thread is not None:
+            self.__thread.join()
+        self.write(self.snapshot())
+
+    def snapshot(self) -> Dict[str, Any]:
+        gauges = { name: fun() for (name, fun) in self.__gauges.items() }
+        with self.__lock:
+            counters = dict(self.__counters)
+            seconds = dict(self.__seconds)
+            workers = dict(self.__workers)
+        for (stage, fun) in self.__stages.items():
+            seconds[stage] = seconds.get(stage, 0.0) + fun()
+        now = time.time()
+        elapsed = now - self.__start
+        scored = counters.get("pairs_scored", 0)
+        rate = scored / elapsed if elapsed > 0 else 0.0
+        remaining = max(0, self.total_pairs - scored)
+        return {
+            "time": now,
+            "elapsed_seconds": elapsed,
+            "total_pairs": self.total_pairs,
+            "remaining_pairs": remaining,
+            "pairs_per_second": rate,
+            "eta_seconds": remaining / rate if rate > 0 else None,
+            "counters": counters,
+            "stage_seconds": seconds,
+            "gauges": gauges,
+            "worker_rss_mb": { str(pid): rss for (pid, rss) in sorted(workers.items()) },
+            "main_rss_mb": rss_mb(),
+            }
+
+    def write(self, snap: Dict[str, Any]):
+        """Prints the progress of a snapshot and writes it to the JSON-lines file and the Prometheus textfile."""
+        done = 100.0 * (1.0 - snap["remaining_pairs"] / snap["total_pairs"]) if snap["total_pairs"] > 0 else 100.0
+        eta = "unknown" if snap["eta_seconds"] is None else format_seconds(snap["eta_seconds"])
+        print("Progress: %.1f%% of %d pairs, %.0f pairs/s, ETA %s" % (done, snap["total_pairs"], snap["pairs_per_second"], eta), flush=True)
+        if self.__jsonl_path is not None:
+            with open(self.__jsonl_path, "a") as f:
+                f.write(json.dumps(snap, sort_keys=True) + "\n")
+        if self.__prom_path is not None:
+            tmp_path = self.__prom_path + ".tmp"
+            with open(tmp_path, "w") as f:
+                f.write(prometheus_text(snap))
+            os.replace(tmp_path, self.__prom_path)
+
+    def __run(self):
+        while not self.__stopped.wait(self.__interval):
+            self.write(self.snapshot())
+
+
+def format_seconds(seconds: float) -> str:
+    (minutes, seconds) = divmod(int(seconds), 60)
+    (hours, minutes) = divmod(minutes, 60)
+    return "%d:%02d:%02d" % (hours, minutes, seconds)
+
+
+def prometheus_text(snap: Dict[str, Any]) -> str:
+    """Formats a snapshot in the Prometheus text exposition format."""
+    lines = list()
+
+    def metric(name, kind, samples):
+        lines.append("# TYPE " + PREFIX + name + " " + kind)
+        for (labels, value) in samples:
+            if value is not None:
+                lines.append(PREFIX + name + labels + " " + repr(float(value)))
+
+    for (name, value) in sorted(snap["counters"].items()):
+        metric(name + "_total", "counter", [("", value)])
+    metric("stage_seconds_total", "counter",
+        [ ('{stage="' + stage + '"}', value) for (stage, value) in sorted(snap["stage_seconds"].items()) ])
+    for (name, value) in sorted(snap["gauges"].items()):
+        metric(name, "gauge", [("", value)])
+    metric("worker_rss_bytes", "gauge",
+        [ ('{pid="' + pid + '"}', rss * 1048576.0) for (pid, rss) in snap["worker_rss_mb"].items() ])
+    metric("main_rss_bytes", "gauge", [("", snap["main_rss_mb"] * 1048576.0)])
+    metric("elapsed_seconds", "gauge", [("", snap["elapsed_seconds"])])
+    metric("total_pairs", "gauge", [("", snap["total_pairs"])])
+    metric("remaining_pairs", "gauge", [("", snap["remaining_pairs"])])
+    metric("pairs_per_second", "gauge", [("", snap["pairs_per_second"])])
+    metric("eta_seconds", "gauge", [("", snap["eta_seconds"])])
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,155 @@
+import asyncio
+import time
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import *
+
+import numpy as np
+from scipy.sparse import isspmatrix, vstack
+
+import simblock
+import vecstore
+
+MAX_BATCH = 256         # Queries scored in one matrix product
+MAX_WAIT = 0.002        # Seconds a query waits for others to join its batch
+WINDOW = 10000          # Latencies the percentiles are computed over
+
+
+class SimilarityIndex:
+    """Top-k cosine similarity queries against the vectors of all methods of a corpus.
+
+    The rows of the vector store are normalized once. A query is either a
+    method of the corpus (by id) or a kwset, which is vectorized by vect (the
+    fitted pipeline of the store); a whole batch of queries is scored with one
+    matrix product.
+    """
+
+    def __init__(self, store: vecstore.VectorStore, vect):
+        self.__store = store
+        self.__vect = vect
+        self.__matrix = simblock.normalize_rows(store.matrix)
+
+    def __len__(self) -> int:
+        return self.__matrix.shape[0]
+
+    def row(self, method_id: int) -> int:
+        """Row of a method of the corpus, KeyError if it is unknown."""
+        return int(self.__store.rows([method_id])[0])
+
+    def search(self, queries: List[Tuple[Optional[int], Optional[str], int]]) -> List[List[Tuple[int, float]]]:
+        """The k most similar methods (id, sim) of every (row, kwset, k) query, by decreasing sim.
+
+        Exactly one of row (see row()) and kwset is given per query; a method
+        is not returned as similar to itself.
+        """
+        texts = [ kwset for (row, kwset, k) in queries if row is None ]
+        text_vecs = simblock.normalize_rows(self.__vect.transform(np.asarray(texts))) if len(texts) > 0 else None
+        (parts, exclude, t) = (list(), list(), 0)
+        for (row, kwset, k) in queries:
+            if row is None:
+                parts.append(text_vecs[t:t + 1])
+                exclude.append(-1)
+                t += 1
+            else:
+                parts.append(self.__matrix[row:row + 1])
+                exclude.append(row)
+        Q = vstack(parts, format="csr") if isspmatrix(self.__matrix) else np.vstack([ np.asarray(p) for p in parts ])
+
+        top = simblock.top_k(simblock.block_sims(Q, self.__matrix), max( k for (row, kwset, k) in queries ), exclude)
+        ids = self.__store.ids
+        return [ list(zip(ids[cols[:k]].tolist(), sims[:k].tolist())) for ((cols, sims), (row, kwset, k)) in zip(top, queries) ]
+
+
+class LatencyStats:
+    """Latencies of the last window queries and sizes of the batches they were scored in."""
+
+    def __init__(self, window: int = WINDOW):
+        self.__latencies = deque(maxlen=window)
+        self.__batches = deque(maxlen=window)
+        self.queries = 0
+
+    def add(self, seconds: float):
+        self.__latencies.append(seconds)
+        self.queries += 1
+
+    def add_batch(self, size: int):
+        self.__batches.append(size)
+
+    def snapshot(self) -> Dict[str, Any]:
+        latencies = np.asarray(self.__latencies) * 1000.0
+        (p50, p99) = np.percentile(latencies, [50, 99]).tolist() if len(latencies) > 0 else (0.0, 0.0)
+        return { "queries": self.queries, "p50_ms": p50, "p99_ms": p99,
+            "mean_batch": float(np.mean(self.__batches)) if len(self.__batches) > 0 else 0.0 }
+
+
+class MicroBatcher:
+    """Scores concurrent queries of an asyncio server in batches.
+
+    query() enqueues a query and waits for its result. A single task takes
+    the first waiting query, adds all others that arrive within max_wait
+    seconds (up to max_batch) and scores them with one SimilarityIndex.search()
+    on a worker thread, so the event loop keeps accepting the queries of the
+    next batch meanwhile.
+    """
+
+    def __init__(self, index: SimilarityIndex, max_batch: int = MAX_BATCH, max_wait: float = MAX_WAIT, stats: Optional[LatencyStats] = None):
+        self.index = index
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.stats = stats or LatencyStats()
+        self.__executor = ThreadPoolExecutor(1)
+        self.__queue = None
+        self.__task = None
+
+    def start(self):
+        """Starts the batching task on the current event loop."""
+        self.__queue = asyncio.Queue()
+        self.__task = asyncio.ensure_future(self.__run())
+
+    def stop(self):
+        self.__task.cancel()
+        self.__executor.shutdown()
+
+    async def query(self, method_id: Optional[int] = None, kwset: Optional[str] = None, k: int = 10) -> List[Tuple[int, float]]:
+        """The k most similar methods (id, sim) of a method of the corpus or of a kwset. Raises KeyError for unknown ids."""
+        start = time.perf_counter()
+        # Unknown ids fail here, before they could fail the whole batch
+        row = None if method_id is None else self.index.row(method_id)
+        future = asyncio.get_event_loop().create_future()
+        self.__queue.put_nowait(((row, kwset, k), future))
+        result = await future
+        self.stats.add(time.perf_counter() - start)
+        return result
+
+    async def __run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            batch = [ await self.__queue.get() ]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                if not self.__queue.empty():
+                    batch.append(self.__queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.__queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # Clients that went away do not need an answer
+            batch = [ (query, future) for (query, future) in batch if not future.cancelled() ]
+            if len(batch) == 0:
+                continue
+            self.stats.add_batch(len(batch))
+            try:
+                results = await loop.run_in_executor(self.__executor, self.index.search, [ query for (query, future) in batch ])
+            except Exception as e:
+                for (query, future) in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for ((query, future), result) in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+# Serves the most similar methods of a corpus over local HTTP (TCP or a Unix socket):
+#   GET  /similar?id=<method id>&k=10
+#   POST /similar  {"kwset": "<kwset>", "k": 10}  (or {"id": <method id>, "k": 10})
+#   GET  /stats    number of queries, p50/p99 latency and mean batch size
+# The fitted pipeline and the vector store are those of calcsim.py for the same
+# configuration, and are only built if they are not cached yet.
+
+import argparse
+import ast
+import asyncio
+import json
+import os
+import sys
+import time
+
+from urllib.parse import parse_qs, urlsplit
+
+import corpus
+import fitcache
+import partransform
+import simmetrics
+import simquery
+import vecstore
+
+CONFIG = "(('var', 1e-08), 'ppmicds', ('none',), False, 0.9, False, False, 3)"
+MAX_K = 1000
+STATUS = { 200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 500: "Internal Server Error" }
+
+
+def respond(writer, status, body, keep_alive):
+    data = json.dumps(body).encode("utf-8")
+    writer.write(("HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\nConnection: %s\r\n\r\n"
+        % (status, STATUS[status], len(data), "keep-alive" if keep_alive else "close")).encode("ascii") + data)
+
+
+async def route(method, target, body):
+    url = urlsplit(target)
+    if url.path == "/stats":
+        return (200, batcher.stats.snapshot())
+    if url.path != "/similar":
+        return (404, { "error": "unknown path " + url.path })
+    if method == "GET":
+        params = { name: values[0] for (name, values) in parse_qs(url.query).items() }
+    elif method == "POST":
+        params = json.loads(body.decode("utf-8"))
+        if not isinstance(params, dict):
+            raise ValueError("expected a JSON object")
+    else:
+        return (405, { "error": "use GET or POST" })
+    k = int(params.get("k", args.k))
+    if not 0 < k <= MAX_K:
+        raise ValueError("k must be between 1 and " + str(MAX_K))
+    if ("id" in params) == ("kwset" in params):
+        raise ValueError("give either id or kwset")
+    try:
+        if "id" in params:
+            similar = await batcher.query(method_id=int(params["id"]), k=k)
+        else:
+            similar = await batcher.query(kwset=str(params["kwset"]), k=k)
+    except KeyError:
+        return (404, { "error": "unknown method id " + str(params["id"]) })
+    return (200, { "similar": [ { "id": mid, "sim": sim } for (mid, sim) in similar ] })
+
+
+async def handle(reader, writer):
+    # HTTP/1.1 with keep-alive, one request after the other
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            (method, target, version) = request_line.decode("latin-1").split()
+            headers = dict()
+            while True:
+                line = (await reader.readline()).decode("latin-1").strip()
+                if not line:
+                    break
+                (name, value) = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", "0")))
+            keep_alive = headers.get("connection", "keep-alive" if version == "HTTP/1.1" else "close").lower() != "close"
+            try:
+                (status, result) = await route(method, target, body)
+            except ValueError as e:
+                (status, result) = (400, { "error": str(e) })
+            except Exception as e:
+                print("[E] " + repr(e))
+                (status, result) = (500, { "error": repr(e) })
+            respond(writer, status, result, keep_alive)
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (ValueError, ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def report():
+    while True:
+        await asyncio.sleep(args.report_interval)
+        snap = batcher.stats.snapshot()
+        print("%d queries, p50 %.2f ms, p99 %.2f ms, mean batch %.1f" % (snap["queries"], snap["p50_ms"], snap["p99_ms"], snap["mean_batch"]))
+        sys.stdout.flush()
+
+
+parser = argparse.ArgumentParser(description="Serves top-k similar method queries against the methods in docs.db")
+parser.add_argument("--db", default="./docs.db", help="database of the corpus (default: ./docs.db)")
+parser.add_argument("--config", default=CONFIG, help="get_vectorizer configuration (default: that of calcsim.py, " + CONFIG + ")")
+parser.add_argument("--dtype", default="float64", choices=["float64", "float32"],
+    help="floating point type of the vectors (default: float64)")
+parser.add_argument("--host", default="127.0.0.1", help="address to listen on (default: 127.0.0.1)")
+parser.add_argument("--port", type=int, default=8410, help="port to listen on (default: 8410)")
+parser.add_argument("--unix", default=None, help="listen on this Unix socket instead of TCP")
+parser.add_argument("--k", type=int, default=10, help="number of similar methods if a query does not give k (default: 10)")
+parser.add_argument("--max-batch", type=int, default=simquery.MAX_BATCH,
+    help="queries scored in one matrix product (default: " + str(simquery.MAX_BATCH) + ")")
+parser.add_argument("--max-wait", type=float, default=simquery.MAX_WAIT * 1000.0,
+    help="milliseconds a query waits for others to join its batch (default: " + str(simquery.MAX_WAIT * 1000.0) + ")")
+parser.add_argument("--report-interval", type=float, default=simmetrics.INTERVAL,
+    help="seconds between latency reports (default: " + str(simmetrics.INTERVAL) + ")")
+parser.add_argument("--jobs", type=int, default=-1,
+    help="number of processes to fit and vectorize the corpus with, if they are not cached (default: -1, i.e., all cores)")
+parser.add_argument("--store-dir", default=vecstore.STORE_DIR,
+    help="directory of the vector stores (default: " + vecstore.STORE_DIR + ")")
+args = parser.parse_args()
+
+config = ast.literal_eval(args.config)
+source = corpus.CorpusSource(args.db)
+start = time.perf_counter()
+vect = fitcache.get_vectorizer(source, *config, n_jobs=args.jobs, dtype=args.dtype)
+store = vecstore.get_store(config, source, lambda: vect, args.store_dir,
+    vecstore.BATCH_SIZE * (args.jobs if args.jobs > 0 else os.cpu_count()), args.dtype)
+if isinstance(vect, partransform.ParallelTransformer):
+    # Queries are vectorized in this process
+    vect.close()
+    vect = vect.transformer
+index = simquery.SimilarityIndex(store, vect)
+print("Loaded %d methods in %.1f s, peak RSS: %.1f MiB" % (len(index), time.perf_counter() - start, corpus.peak_rss_mb()))
+
+loop = asyncio.new_event_loop()
+asyncio.set_event_loop(loop)
+batcher = simquery.MicroBatcher(index, args.max_batch, args.max_wait / 1000.0)
+batcher.start()
+if args.unix is not None:
+    server = loop.run_until_complete(asyncio.start_unix_server(handle, args.unix))
+    print("Listening on " + args.unix)
+else:
+    server = loop.run_until_complete(asyncio.start_server(handle, args.host, args.port))
+    print("Listening on http://%s:%d" % (args.host, args.port))
+sys.stdout.flush()
+reporter = asyncio.ensure_future(report())
+try:
+    loop.run_forever()
+except KeyboardInterrupt:
+    pass
+finally:
+    reporter.cancel()
+    server.close()
+    loop.run_until_complete(server.wait_closed())
+    batcher.stop()
+    if args.unix is not None and os.path.exists(args.unix):
+        os.unlink(args.unix)
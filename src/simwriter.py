@@ -0,0 +1,215 @@
+import queue
+import sqlite3
+import threading
+import time
+
+from typing import *
+
+QUEUE_SIZE = 64
+BATCH_ROWS = 1000000
+
+PRAGMAS = [
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -1048576",   # 1 GiB
+    "PRAGMA temp_store = MEMORY",
+    ]
+
+_FLUSH = object()
+_CLOSE = object()
+
+
+def create_tables(conn: sqlite3.Connection, with_pk: bool = True, with_view: bool = True):
+    """Creates internal_methodsim, its progress journal and (optionally) the methodsim view if they do not exist yet."""
+    c = conn.cursor()
+    if with_pk:
+        c.execute('''CREATE TABLE IF NOT EXISTS internal_methodsim
+                (first_id INT, second_id INT, sim_cs REAL, sim_tok REAL DEFAULT -1,
+                    PRIMARY KEY (first_id, second_id))''')
+    else:
+        c.execute('''CREATE TABLE IF NOT EXISTS internal_methodsim
+                (first_id INT, second_id INT, sim_cs REAL, sim_tok REAL DEFAULT -1)''')
+
+    # Journal of the (block1, block2) units of the similarity matrix whose rows are completely committed,
+    # and the vector store and flags of the run that wrote them
+    c.execute('''CREATE TABLE IF NOT EXISTS internal_methodsim_progress
+            (block1 INT, block2 INT, block_size INT, PRIMARY KEY (block1, block2))''')
+    c.execute('''CREATE TABLE IF NOT EXISTS internal_methodsim_settings
+            (block_size INT, store TEXT, min_sim REAL, both_orders INT, dtype TEXT)''')
+
+    if not with_view:
+        conn.commit()
+        return
+
+    c.execute('''CREATE VIEW IF NOT EXISTS methodsim
+            (project1, project2, file1, file2, method1, method2, sim_cs, sim_tok) AS
+                SELECT p1.name, p2.name, d1.file, d2.file, d1.method, d2.method, s.sim_cs, s.sim_tok
+                    FROM internal_methodsim s JOIN internal_filtered_methoddocs d1 ON s.first_id = d1.id
+                        JOIN projects p1 ON d1.project_id = p1.id
+                        JOIN internal_filtered_methoddocs d2 ON s.second_id = d2.id
+                        JOIN projects p2 ON d2.project_id = p2.id''')
+    conn.commit()
+
+
+def load_progress(conn: sqlite3.Connection, block_size: int, store: str, min_sim: float, both_orders: bool, dtype: str) -> Set[Tuple[int, int]]:
+    """Returns the (block1, block2) units that are already committed.
+
+    A new run records its block size, vector store (its directory name) and
+    flags. Raises an exception if the committed units were computed with
+    other ones, or if internal_methodsim contains rows that are not covered
+    by the journal.
+    """
+    settings = (block_size, store, float(min_sim), int(both_orders), dtype)
+    c = conn.cursor()
+    c.execute('''SELECT DISTINCT block_size FROM internal_methodsim_progress''')
+    sizes = [ row[0] for row in c.fetchall() ]
+    if any( size != block_size for size in sizes ):
+        raise Exception("Progress journal was written with block size " + str(sizes[0]) + ", resume with that size")
+    c.execute('''SELECT block1, block2 FROM internal_methodsim_progress''')
+    done = set( (row[0], row[1]) for row in c.fetchall() )
+    c.execute('''SELECT block_size, store, min_sim, both_orders, dtype FROM internal_methodsim_settings''')
+    row = c.fetchone()
+    if len(done) == 0:
+        c.execute('''SELECT count(*) FROM (SELECT 1 FROM internal_methodsim LIMIT 1)''')
+        if int(c.fetchone()[0]) > 0:
+            raise Exception("internal_methodsim contains rows without progress journal, cannot resume")
+        c.execute('''DELETE FROM internal_methodsim_settings''')
+        c.execute('''INSERT INTO internal_methodsim_settings VALUES (?, ?, ?, ?, ?)''', settings)
+        conn.commit()
+    elif row is None:
+        raise Exception("Progress journal does not record the vector store and flags it was written with, cannot resume")
+    elif tuple(row) != settings:
+        raise Exception("Progress journal was written with vector store " + str(row[1]) + ", --min-sim " + str(row[2])
+            + (", --both-orders" if row[3] else "") + " and --dtype " + str(row[4]) + ", resume with those")
+    return done
+
+
+def record_shard(conn: sqlite3.Connection, shard: int, shards: int, block_size: int, store: str, units: int):
+    """Records which shard of the unit grid a shard database holds, or checks that it matches an earlier run."""
+    c = conn.cursor()
+    c.execute('''CREATE TABLE IF NOT EXISTS internal_methodsim_shard
+            (shard INT, shards INT, block_size INT, store TEXT, units INT)''')
+    c.execute('''SELECT shard, shards, block_size, store, units FROM internal_methodsim_shard''')
+    row = c.fetchone()
+    if row is None:
+        c.execute('''INSERT INTO internal_methodsim_shard VALUES (?, ?, ?, ?, ?)''',
+            (shard, shards, block_size, store, units))
+        conn.commit()
+    elif tuple(row) != (shard, shards, block_size, store, units):
+        raise Exception("Shard database was written for shard " + str(row[0]) + "/" + str(row[1])
+            + " with block size " + str(row[2]) + " and vector store " + str(row[3]))
+
+
+def create_index(conn: sqlite3.Connection):
+    """Builds the unique (first_id, second_id) index of internal_methodsim."""
+    conn.execute('''CREATE UNIQUE INDEX IF NOT EXISTS internal_methodsim_idpair
+            ON internal_methodsim (first_id, second_id)''')
+    conn.commit()
+
+
+class MethodSimWriter:
+    """Inserts (first_id, second_id, sim_cs) rows into an existing internal_methodsim from a dedicated thread.
+
+    Rows are handed over through a bounded queue, so producers block instead
+    of piling up results when the database falls behind. The writer collects
+    them into large transactions, sorted by (first_id, second_id), so the
+    primary key B-tree is updated in order instead of at random positions.
+    Sorting is cheap if every put() already hands over sorted rows.
+
+    Without a primary key (with_pk=False), the table is loaded unsorted as a
+    heap and the unique (first_id, second_id) index is built once in close().
+    """
+
+    def __init__(self, db_path: str, with_pk: bool = True, queue_size: int = QUEUE_SIZE, batch_rows: int = BATCH_ROWS, block_size: int = 0):
+        self.__db_path = db_path
+        self.__block_size = block_size
+        self.__with_pk = with_pk
+        self.__batch_rows = batch_rows
+        self.__queue = queue.Queue(maxsize=queue_size)
+        self.__error = None
+        self.rows_committed = 0
+        self.commit_seconds = 0.0
+        self.__thread = threading.Thread(target=self.__run, name="MethodSimWriter", daemon=True)
+        self.__thread.start()
+
+    def put(self, rows: List[Tuple[int, int, float]], unit: Optional[Tuple[int, int]] = None):
+        """Queues rows for insertion, blocking while the queue is full.
+
+        If the rows are all rows of a (block1, block2) unit, the unit is
+        recorded in the progress journal in the same transaction as the rows.
+        """
+        self.__check()
+        self.__queue.put((rows, unit))
+
+    def flush(self):
+        """Blocks until all queued rows are committed."""
+        done = threading.Event()
+        self.__queue.put((_FLUSH, done))
+        while not done.wait(1.0):
+            self.__check()
+        self.__check()
+
+    def close(self):
+        """Commits all queued rows, builds the index if necessary and stops the writer thread."""
+        self.__queue.put(_CLOSE)
+        self.__thread.join()
+        self.__check()
+
+    def qsize(self) -> int:
+        return self.__queue.qsize()
+
+    def __check(self):
+        if self.__error is not None:
+            raise RuntimeError("MethodSimWriter failed") from self.__error
+
+    def __run(self):
+        try:
+            conn = sqlite3.connect(self.__db_path, isolation_level=None)
+            for pragma in PRAGMAS:
+                conn.execute(pragma)
+            pending = list()
+            units = list()
+            while True:
+                item = self.__queue.get()
+                if item is _CLOSE:
+                    self.__commit(conn, pending, units)
+                    if not self.__with_pk:
+                        create_index(conn)
+                    conn.close()
+                    return
+                elif item[0] is _FLUSH:
+                    self.__commit(conn, pending, units)
+                    pending = list()
+                    units = list()
+                    item[1].set()
+                else:
+                    pending.extend(item[0])
+                    if item[1] is not None:
+                        units.append(item[1] + (self.__block_size, ))
+                    if len(pending) >= self.__batch_rows:
+                        self.__commit(conn, pending, units)
+                        pending = list()
+                        units = list()
+        except BaseException as e:
+            self.__error = e
+            # Unblock producers waiting on a full queue
+            while True:
+                try:
+                    item = self.__queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not _CLOSE and item[0] is _FLUSH:
+                    item[1].set()
+
+    def __commit(self, conn: sqlite3.Connection, rows: List[Tuple[int, int, float]], units: List[Tuple[int, int, int]]):
+        if len(rows) == 0 and len(units) == 0:
+            return
+        start = time.perf_counter()
+        if self.__with_pk:
+            rows.sort()
+        conn.execute("BEGIN")
+        conn.executemany('''INSERT INTO internal_methodsim VALUES (?, ?, ?, -1)''', rows)
+        conn.executemany('''INSERT INTO internal_methodsim_progress VALUES (?, ?, ?)''', units)
+        conn.execute("COMMIT")
+        self.rows_committed += len(rows)
+        self.commit_seconds += time.perf_counter() - start
@@ -0,0 +1,158 @@
+import copy
+
+from collections import OrderedDict
+from typing import *
+
+import numpy as np
+
+from sklearn.base import BaseEstimator
+from sklearn.pipeline import make_pipeline
+
+import tokens
+import vectorizer
+
+if TYPE_CHECKING:
+    from sklearn.decomposition import TruncatedSVD
+
+CAPACITY = 2            # Term-document matrices (per vsm, and per feature selection) kept in memory
+SVD_ATTRIBUTES = ["components_", "explained_variance_", "explained_variance_ratio_", "singular_values_"]
+
+
+def truncate_svd(svd: "TruncatedSVD", n_components: int) -> "TruncatedSVD":
+    """A fitted TruncatedSVD restricted to its first n_components components.
+
+    Components are ordered by singular value, and the explained variance of
+    each component does not depend on the others, so this is a TruncatedSVD
+    with n_components components fitted by a more accurate decomposition.
+    """
+    if n_components == svd.n_components:
+        return svd
+    svd = copy.copy(svd)
+    svd.n_components = n_components
+    for name in SVD_ATTRIBUTES:
+        if hasattr(svd, name):
+            setattr(svd, name, getattr(svd, name)[:n_components].copy())
+    return svd
+
+
+class _LRU:
+    def __init__(self, capacity: int):
+        self.__capacity = capacity
+        self.__entries = OrderedDict()
+
+    def get(self, key):
+        value = self.__entries.get(key)
+        if value is not None:
+            self.__entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.__entries[key] = value
+        self.__entries.move_to_end(key)
+        while len(self.__entries) > self.__capacity:
+            self.__entries.popitem(last=False)
+
+
+class StagedFitter:
+    """Fits get_vectorizer configurations stage by stage, reusing the stages they share.
+
+    The vsm is fitted once per (vsm, stop words, max_df, lowercase, ngram),
+    and its term-document matrix of the corpus is kept for the next
+    configurations, like the output of each VarianceThreshold on top of it.
+    Only the reduction is fitted per configuration, and once for both values
+    of the normalizer. LSA is fitted with max(n_components, lsa_components)
+    components and truncated, so all LSA sizes of a search share one SVD.
+    LDA runs for at most lda_seconds (if given) and is warm-started from the
+    last LDA with fewer topics on the same term-document matrix, so it
+    depends on the configurations fitted before.
+
+    The pipelines have the same structure as those of
+    vectorizer.get_vectorizer(), and apart from LSA (see variant()) their
+    results are the same. Embeddings are delegated to it, and train on
+    workers threads (n_jobs if None).
+    capacity bounds the number of term-document matrices in memory. The
+    tokens of the last corpus are kept as long as the fitter.
+    """
+
+    def __init__(self, lsa_components: Optional[int] = None, lda_seconds: Optional[float] = None, capacity: int = CAPACITY, workers: Optional[int] = None):
+        self.lsa_components = lsa_components
+        self.lda_seconds = lda_seconds
+        self.workers = workers
+        self.__tokens = tokens.TokenCache()
+        self.__outputs = _LRU(capacity)
+        self.__reductions = _LRU(1)
+        self.__topic_models = _LRU(1)
+
+    def variant(self, config: Tuple) -> str:
+        """Tells fitcache which configurations are fitted differently than by vectorizer.get_vectorizer()."""
+        tsim = config[2]
+        if tsim[0] == "lsa" and self.lsa_components is not None and self.lsa_components > tsim[1]:
+            return "lsa truncated from " + str(self.lsa_components)
+        if tsim[0] == "lda":
+            return "lda warm-started" + ("" if self.lda_seconds is None else " within " + str(self.lda_seconds) + " s")
+        return ""
+
+    def get_vectorizer(self, dataset: Iterable[str], fselect: Tuple[str, ...], vsm: Union[str, Tuple[str, int]], tsim: Tuple[str, ...], use_stop_words: bool, max_df: float, lowercase: bool, use_normalizer: bool, ngram: int, n_jobs: int = 1, dtype=np.float64) -> BaseEstimator:
+        # Embeddings are trained on the documents, reductions (including registered ones) are staged
+        if tsim[0] != "none" and tsim[0] not in vectorizer.REDUCTIONS:
+            return vectorizer.get_vectorizer(dataset, fselect, vsm, tsim, use_stop_words, max_df, lowercase, use_normalizer, ngram, n_jobs, dtype, self.workers)
+        try:
+            (weighting, out) = self.__weighting(dataset, fselect, vsm, use_stop_words, max_df, lowercase, ngram, n_jobs, dtype)
+            reduction = None
+            if tsim[0] != "none":
+                reduction = self.__reduction(dataset, fselect, vsm, tsim, use_stop_words, max_df, lowercase, ngram, out, n_jobs)
+            vect = vectorizer.assemble(weighting, reduction, use_normalizer, dtype)
+        except MemoryError:
+            print("[E] out of memory on configuration " + str(vsm) + ", " + str(tsim) + ", " + str(use_stop_words) + ", " + str(max_df) + ", " + str(lowercase) + ", " + str(use_normalizer) + ", " + str(ngram))
+            raise
+        return vectorizer.parallelize(vect, n_jobs)
+
+    def __weighting(self, dataset, fselect, vsm, use_stop_words, max_df, lowercase, ngram, n_jobs, dtype):
+        # The fitted vsm (with its feature selection) and its term-document matrix of the dataset
+        # Entries hold the dataset, so its id is not reused while they are cached
+        key = (id(dataset), vsm, use_stop_words, max_df, lowercase, ngram, np.dtype(dtype).name)
+        entry = self.__outputs.get(key)
+        if entry is None:
+            entry = (dataset, ) + vectorizer.fit_weighting(dataset, ("all", ), vsm, use_stop_words, max_df, lowercase, ngram, n_jobs, dtype, self.__tokens)
+            self.__outputs.put(key, entry)
+        (_, vect, out) = entry
+        if fselect[0] == "all":
+            return (vect, out)
+
+        selected = self.__outputs.get(key + (fselect, ))
+        if selected is None:
+            var = vectorizer.get_weighting(fselect, vsm, use_stop_words, max_df, lowercase, ngram, n_jobs).steps[-1][1]
+            selected = (dataset, var, var.fit_transform(out))
+            self.__outputs.put(key + (fselect, ), selected)
+            # Refresh the vsm entry, so it is evicted after the selections on top of it
+            self.__outputs.get(key)
+        (_, var, out) = selected
+        return (make_pipeline(vect, var), out)
+
+    def __reduction(self, dataset, fselect, vsm, tsim, use_stop_words, max_df, lowercase, ngram, out, n_jobs):
+        if tsim[0] == "lsa":
+            # At most n_features - 1 components, but never fewer than asked for
+            n_components = max(tsim[1], min(self.lsa_components or 0, out.shape[1] - 1))
+            fit_tsim = ("lsa", n_components)
+        else:
+            fit_tsim = tsim
+        key = (id(dataset), fselect, vsm, fit_tsim, use_stop_words, max_df, lowercase, ngram, out.dtype.name)
+        entry = self.__reductions.get(key)
+        if entry is None:
+            reduction = vectorizer.get_reduction(fit_tsim, n_jobs)
+            # LDA of the same term-document matrix, whatever its size
+            base = key[:3] + key[4:]
+            if tsim[0] == "lda":
+                reduction.set_params(max_seconds=self.lda_seconds)
+                topic_model = self.__topic_models.get(base)
+                if topic_model is not None and topic_model[1].n_topics < tsim[1]:
+                    reduction.set_params(warm_start=topic_model[1])
+            reduction.fit(out)
+            if tsim[0] == "lda":
+                self.__topic_models.put(base, (dataset, reduction))
+            entry = (dataset, reduction)
+            self.__reductions.put(key, entry)
+        (_, reduction) = entry
+        if tsim[0] == "lsa":
+            return truncate_svd(reduction, tsim[1])
+        return reduction
@@ -0,0 +1,53 @@
+import numpy as np
+
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.feature_extraction.text import CountVectorizer, TfidfTransformer
+
+import tokens
+
+
+class TfidfVectorizer(BaseEstimator, TransformerMixin):
+    """Like scikit-learn's TfidfVectorizer, but it can also be fitted on the counts of a tokenized corpus.
+
+    The arguments are those of TfidfVectorizer. The vectors are the same as
+    those of a TfidfVectorizer fitted on the same documents.
+    """
+
+    def __init__(self, dtype=np.float64, **kwargs):
+        self.__max_df = kwargs.pop("max_df", 1.0)
+        self.__min_df = kwargs.pop("min_df", 1)
+        self.__max_features = kwargs.pop("max_features", None)
+        self.__tfidf_params = { name: kwargs.pop(name) for name in ["norm", "use_idf", "smooth_idf", "sublinear_tf"] if name in kwargs }
+        self.__cv_params = kwargs
+        self.__dtype = dtype
+        self.__cv = None
+        self.__tfidf = None
+
+    def fit(self, X, y=None, **fit_params):
+        cv = CountVectorizer(max_df=self.__max_df, min_df=self.__min_df, max_features=self.__max_features, **self.__cv_params)
+        counts = cv.fit_transform(X)
+        self.__fit(counts, cv.vocabulary_)
+        return self
+
+    def fit_transform_counts(self, counts, terms):
+        """Fits on the term-document counts of a corpus (e.g. by tokens.TokenView.counts()) and returns its vectors.
+
+        The columns of counts are the given terms in alphabetical order.
+        """
+        mask = tokens.limit_terms(np.asarray(counts.sum(0)).ravel(), np.bincount(counts.indices, minlength=len(terms)), counts.shape[0],
+            self.__max_df, self.__min_df, self.__max_features)
+        columns = np.where(mask)[0]
+        counts = counts[:, columns]
+        self.__fit(counts, { terms[i]: j for (j, i) in enumerate(columns.tolist()) })
+        return self.__tfidf.transform(counts).astype(self.__dtype, copy=False)
+
+    def transform(self, X, y=None, **fit_params):
+        return self.__tfidf.transform(self.__cv.transform(X)).astype(self.__dtype, copy=False)
+
+    def fit_transform(self, X, y=None, **fit_params):
+        self.fit(X)
+        return self.transform(X)
+
+    def __fit(self, counts, vocabulary):
+        self.__cv = CountVectorizer(vocabulary=vocabulary, **self.__cv_params)
+        self.__tfidf = TfidfTransformer(**self.__tfidf_params).fit(counts)
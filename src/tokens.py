@@ -0,0 +1,179 @@
+import numbers
+import re
+
+from array import array
+from collections.abc import Sequence
+from typing import *
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+TOKEN_PATTERN = r"(?u)\b\w\w+\b"     # The default token_pattern of CountVectorizer
+
+
+def limit_terms(term_counts: np.ndarray, doc_freqs: np.ndarray, n_docs: int, max_df=1.0, min_df=1, max_features: Optional[int] = None) -> np.ndarray:
+    """Mask of the terms kept by max_df, min_df and max_features, like CountVectorizer._limit_features()."""
+    max_doc_count = max_df if isinstance(max_df, numbers.Integral) else max_df * n_docs
+    min_doc_count = min_df if isinstance(min_df, numbers.Integral) else min_df * n_docs
+    mask = (doc_freqs <= max_doc_count) & (doc_freqs >= min_doc_count)
+    if max_features is not None and mask.sum() > max_features:
+        mask_inds = (-term_counts[mask]).argsort()[:max_features]
+        new_mask = np.zeros(len(term_counts), dtype=bool)
+        new_mask[np.where(mask)[0][mask_inds]] = True
+        mask = new_mask
+    if not mask.any():
+        raise ValueError("After pruning, no terms remain. Try a lower min_df or a higher max_df.")
+    return mask
+
+
+class Documents(Sequence):
+    """The documents of a TokenView as lists of terms, built from the token ids when they are accessed."""
+
+    def __init__(self, view: "TokenView"):
+        self.__view = view
+
+    def __len__(self) -> int:
+        return len(self.__view)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [ self[j] for j in range(*i.indices(len(self))) ]
+        terms = self.__view.terms
+        offsets = self.__view.offsets
+        return [ terms[t] for t in self.__view.ids[offsets[i]:offsets[i + 1]].tolist() ]
+
+
+class TokenView:
+    """Documents as token ids into terms: the tokens of document i are ids[offsets[i]:offsets[i + 1]]."""
+
+    def __init__(self, terms: List[str], ids: np.ndarray, offsets: np.ndarray):
+        self.terms = terms
+        self.ids = ids
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def doc_index(self) -> np.ndarray:
+        """The document of every token."""
+        return np.repeat(np.arange(len(self), dtype=np.int64), np.diff(self.offsets))
+
+    def without(self, stop_words: Iterable[str]) -> "TokenView":
+        """The documents without the given terms (with the same term ids)."""
+        stop_words = set(stop_words)
+        stop_ids = np.asarray([ i for (i, term) in enumerate(self.terms) if term in stop_words ], dtype=self.ids.dtype)
+        keep = ~np.isin(self.ids, stop_ids)
+        offsets = np.zeros(len(self.offsets), dtype=np.int64)
+        np.cumsum(np.bincount(self.doc_index()[keep], minlength=len(self)), out=offsets[1:])
+        return TokenView(self.terms, self.ids[keep], offsets)
+
+    def ngrams(self, n: int) -> "TokenView":
+        """The n-grams of consecutive tokens within each document, as terms joined by spaces like CountVectorizer."""
+        if n == 1:
+            return self
+        doc_index = self.doc_index()
+        starts = np.where(np.arange(len(self.ids), dtype=np.int64) + n <= self.offsets[1:][doc_index])[0]
+        # Number the n-grams one token at a time, so the codes stay below len(starts) * len(terms)
+        codes = self.ids[starts].astype(np.int64)
+        for k in range(1, n):
+            (_, codes) = np.unique(codes, return_inverse=True)
+            codes = codes.ravel() * len(self.terms) + self.ids[starts + k]
+        (_, first, ids) = np.unique(codes, return_index=True, return_inverse=True)
+        del codes
+        terms = [ " ".join( self.terms[t] for t in self.ids[p:p + n].tolist() ) for p in starts[first].tolist() ]
+        offsets = np.zeros(len(self.offsets), dtype=np.int64)
+        np.cumsum(np.bincount(doc_index[starts], minlength=len(self)), out=offsets[1:])
+        return TokenView(terms, ids.ravel().astype(np.int32), offsets)
+
+    def counts(self) -> Tuple[csr_matrix, List[str]]:
+        """The term-document count matrix with columns in alphabetical order (like CountVectorizer), and those terms."""
+        order = sorted(range(len(self.terms)), key=self.terms.__getitem__)
+        columns = np.empty(len(order), dtype=np.int32)
+        columns[order] = np.arange(len(order), dtype=np.int32)
+        # int32 indices, like CountVectorizer, unless there are too many tokens
+        indptr = self.offsets.astype(np.int32) if len(self.ids) <= np.iinfo(np.int32).max else self.offsets
+        counts = csr_matrix((np.ones(len(self.ids), dtype=np.int64), columns[self.ids], indptr), shape=(len(self), len(order)))
+        counts.sum_duplicates()
+        return (counts, [ self.terms[i] for i in order ])
+
+    def documents(self) -> Documents:
+        return Documents(self)
+
+
+class _ViewBuilder:
+    def __init__(self):
+        self.__term_ids = dict()
+        self.__ids = array("i")
+        self.__offsets = array("q", [0])
+
+    def add(self, tokens: List[str]):
+        term_ids = self.__term_ids
+        self.__ids.extend([ term_ids.setdefault(token, len(term_ids)) for token in tokens ])
+        self.__offsets.append(len(self.__ids))
+
+    def view(self) -> TokenView:
+        terms = sorted(self.__term_ids, key=self.__term_ids.get)
+        return TokenView(terms, np.frombuffer(self.__ids, dtype=np.int32), np.frombuffer(self.__offsets, dtype=np.int64))
+
+
+class TokenizedCorpus:
+    """A corpus tokenized once per case, into a cased and a lowercased view of its tokens.
+
+    The tokens are those of CountVectorizer's default token_pattern on the
+    documents, and on the documents in lower case, respectively. They are
+    stored as int32 ids in one flat array per view, with one offset per
+    document, so n-grams, counts and term lists of every configuration can
+    be derived without tokenizing the strings again. Each view is built by a
+    pass over docs (which must be iterable more than once) when it is first
+    requested.
+    """
+
+    def __init__(self, docs: Iterable[str]):
+        self.__docs = docs
+        self.__views = dict()
+
+    def __len__(self) -> int:
+        return len(next(iter(self.__views.values())) if len(self.__views) > 0 else self.cased)
+
+    @property
+    def cased(self) -> TokenView:
+        return self.view(False)
+
+    @property
+    def lowercased(self) -> TokenView:
+        return self.view(True)
+
+    def view(self, lowercase: bool) -> TokenView:
+        if lowercase not in self.__views:
+            pattern = re.compile(TOKEN_PATTERN)
+            builder = _ViewBuilder()
+            for doc in self.__docs:
+                builder.add(pattern.findall(doc.lower() if lowercase else doc))
+            self.__views[lowercase] = builder.view()
+        return self.__views[lowercase]
+
+
+class TokenCache:
+    """Keeps the TokenizedCorpus of the last dataset passed to get(), for a caller that fits many configurations on it (see stagefit)."""
+
+    def __init__(self):
+        self.__last = None
+
+    def get(self, dataset: Iterable[str]) -> TokenizedCorpus:
+        # A corpus.CorpusSource is known by its digest, other datasets by identity
+        key = dataset.digest() if hasattr(dataset, "digest") else id(dataset)
+        if self.__last is None or self.__last[0] != key:
+            # The entry holds the dataset, so its id is not reused in the meantime
+            self.__last = None
+            self.__last = (key, dataset, TokenizedCorpus(dataset))
+        return self.__last[2]
+
+    def clear(self):
+        self.__last = None
+
+
+def tokenize(dataset: Iterable[str], cache: Optional[TokenCache] = None) -> TokenizedCorpus:
+    """The TokenizedCorpus of dataset (e.g. a corpus.CorpusSource), reused from cache if it holds the same dataset."""
+    if cache is None:
+        return TokenizedCorpus(dataset)
+    return cache.get(dataset)
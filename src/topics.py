@@ -0,0 +1,100 @@
+import time
+
+from typing import *
+
+import numpy as np
+from scipy.special import psi
+
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.decomposition import LatentDirichletAllocation
+from sklearn.utils import check_random_state, gen_batches
+
+MAX_ITER = 10           # Passes over the corpus, as LatentDirichletAllocation
+PERP_TOL = 1e-3         # Stop when a pass improves the perplexity by less than this fraction
+PERP_SAMPLE = 8192      # Documents the perplexity is estimated on after every pass
+
+
+class BudgetedLDA(BaseEstimator, TransformerMixin):
+    """Online LatentDirichletAllocation on n_jobs cores with an iteration and wall-clock budget.
+
+    fit() runs at most max_iter passes of mini-batches over the documents,
+    like LatentDirichletAllocation.fit() with learning_method="online", and
+    stops early when a pass improves the perplexity (estimated on a fixed
+    sample of PERP_SAMPLE documents) by less than the fraction perp_tol, or
+    after the mini-batch that exceeds max_seconds. With max_seconds set, the
+    result depends on the speed of the machine.
+
+    warm_start is a fitted BudgetedLDA (or LatentDirichletAllocation) with
+    fewer topics on the same features; its topics become the first topics of
+    this model, so fitting many topics needs fewer passes.
+    """
+
+    def __init__(self, n_topics=10, max_iter=MAX_ITER, max_seconds=None, perp_tol=PERP_TOL, warm_start=None, n_jobs=-1,
+            batch_size=16384, learning_decay=0.8, random_state=410):
+        self.n_topics = n_topics
+        self.max_iter = max_iter
+        self.max_seconds = max_seconds
+        self.perp_tol = perp_tol
+        self.warm_start = warm_start
+        self.n_jobs = n_jobs
+        self.batch_size = batch_size
+        self.learning_decay = learning_decay
+        self.random_state = random_state
+        self.__lda = None
+
+    @property
+    def components_(self) -> np.ndarray:
+        return self.__lda.components_
+
+    def fit(self, X, y=None, **fit_params):
+        start = time.perf_counter()
+        (n_docs, n_features) = X.shape
+        lda = LatentDirichletAllocation(n_topics=self.n_topics, learning_method="online", batch_size=self.batch_size,
+            learning_decay=self.learning_decay, total_samples=n_docs, n_jobs=self.n_jobs, random_state=self.random_state)
+        if self.warm_start is not None:
+            self.__warm_start(lda, n_features)
+        sample = X
+        if n_docs > PERP_SAMPLE:
+            sample = X[np.sort(check_random_state(self.random_state).choice(n_docs, PERP_SAMPLE, replace=False))]
+
+        self.n_iter_ = 0
+        self.perplexities_ = list()
+        out_of_time = False
+        while self.n_iter_ < self.max_iter and not out_of_time:
+            for batch in gen_batches(n_docs, self.batch_size):
+                # Same updates as fit(), one mini-batch at a time
+                lda.partial_fit(X[batch])
+                if self.max_seconds is not None and time.perf_counter() - start > self.max_seconds:
+                    out_of_time = True
+                    break
+            self.n_iter_ += 1
+            if out_of_time:
+                break
+            self.perplexities_.append(lda.perplexity(sample))
+            if len(self.perplexities_) > 1 and self.perplexities_[-2] - self.perplexities_[-1] < self.perp_tol * self.perplexities_[-2]:
+                break
+        self.fit_seconds_ = time.perf_counter() - start
+
+        # Transforming is parallelized by the caller (see partransform), not by the model
+        lda.n_jobs = 1
+        self.__lda = lda
+        # Neither kept in memory nor pickled along with this model
+        self.warm_start = None
+        return self
+
+    def transform(self, X, y=None, **fit_params):
+        return self.__lda.transform(X)
+
+    def perplexity(self, X) -> float:
+        return self.__lda.perplexity(X)
+
+    def __warm_start(self, lda, n_features):
+        components = self.warm_start.components_
+        if components.shape[0] > self.n_topics or components.shape[1] != n_features:
+            raise ValueError("Cannot warm-start " + str(self.n_topics) + " topics over " + str(n_features) + " features from a model of shape " + str(components.shape))
+        # The initialization of partial_fit() (which checks the parameters first, e.g. sets _n_components
+        # from n_topics), with the topics of the smaller model in place of the first random ones
+        lda._check_params()
+        lda._init_latent_vars(n_features)
+        lda.components_[:components.shape[0]] = components
+        lda.exp_dirichlet_component_ = np.exp(psi(lda.components_) - psi(lda.components_.sum(1))[:, np.newaxis])
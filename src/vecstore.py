@@ -0,0 +1,146 @@
+import hashlib
+import itertools
+import json
+import os
+import shutil
+import tempfile
+
+from typing import *
+
+import numpy as np
+from scipy.sparse import csr_matrix, isspmatrix, vstack
+
+import corpus
+
+STORE_DIR = "vecstore"
+STORE_VERSION = 1
+BATCH_SIZE = 4096
+
+def fingerprint(config: Tuple, digest: str, dtype=np.float64) -> str:
+    """Key of the vectors of a corpus (by digest) under a get_vectorizer configuration, in dtype."""
+    # float64 stores keep the keys they had before the dtype was configurable
+    dtype_name = "" if np.dtype(dtype) == np.float64 else np.dtype(dtype).name
+    return hashlib.sha256((str(STORE_VERSION) + repr(tuple(config)) + digest + dtype_name).encode("utf-8")).hexdigest()
+
+
+class VectorStore:
+    """Read-only, memory-mapped vectors of all methods of a corpus.
+
+    Rows are ordered by (project_id, id), so all methods of a project, and all
+    methods of the projects from a given one on, are contiguous row ranges.
+    """
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            self.__meta = json.load(f)
+        self.__ids = np.load(os.path.join(path, "ids.npy"), mmap_mode="r")
+        self.__project_ids = np.load(os.path.join(path, "project_ids.npy"), mmap_mode="r")
+        self.__order = np.argsort(self.__ids, kind="mergesort")
+        if self.__meta["sparse"]:
+            self.__matrix = csr_matrix((np.load(os.path.join(path, "data.npy"), mmap_mode="r"),
+                    np.load(os.path.join(path, "indices.npy"), mmap_mode="r"),
+                    np.load(os.path.join(path, "indptr.npy"), mmap_mode="r")),
+                shape=tuple(self.__meta["shape"]), copy=False)
+        else:
+            self.__matrix = np.load(os.path.join(path, "dense.npy"), mmap_mode="r")
+        self.path = path
+
+    @property
+    def ids(self) -> np.ndarray:
+        return self.__ids
+
+    @property
+    def project_ids(self) -> np.ndarray:
+        return self.__project_ids
+
+    @property
+    def matrix(self):
+        return self.__matrix
+
+    def rows(self, ids) -> np.ndarray:
+        """Row positions of the given method ids."""
+        ids = np.asarray(ids)
+        pos = np.searchsorted(self.__ids[self.__order], ids)
+        pos = np.minimum(pos, len(self.__order) - 1)
+        if len(ids) > 0 and np.any(self.__ids[self.__order[pos]] != ids):
+            raise KeyError("Unknown method ids in vector store " + self.path)
+        return self.__order[pos]
+
+    def vectors(self, ids):
+        """Vectors of the given method ids, in the given order."""
+        return self.__matrix[self.rows(ids)]
+
+    def project_range(self, project_id: int) -> Tuple[int, int]:
+        """The (start, stop) row range of all methods of a project."""
+        return (int(np.searchsorted(self.__project_ids, project_id, side="left")),
+            int(np.searchsorted(self.__project_ids, project_id, side="right")))
+
+
+def build_store(path: str, source: corpus.CorpusSource, vect, batch_size: int = BATCH_SIZE) -> VectorStore:
+    """Streams the rows of a corpus, transforms them in batches and persists the result at path."""
+    ids = list()
+    project_ids = list()
+    parts = list()
+    rows = source.rows()
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if len(batch) == 0:
+            break
+        ids.extend( row[0] for row in batch )
+        project_ids.extend( row[1] for row in batch )
+        parts.append(vect.transform(np.asarray([ row[2] for row in batch ])))
+    sparse = len(parts) > 0 and isspmatrix(parts[0])
+    if sparse:
+        matrix = csr_matrix(vstack(parts, format="csr"))
+        matrix.sort_indices()
+        if matrix.nnz <= np.iinfo(np.int32).max and matrix.shape[1] <= np.iinfo(np.int32).max:
+            # Half the index memory of every process that maps the store
+            matrix = csr_matrix((matrix.data, matrix.indices.astype(np.int32, copy=False), matrix.indptr.astype(np.int32, copy=False)),
+                shape=matrix.shape, copy=False)
+    elif len(parts) > 0:
+        matrix = np.vstack([ np.asarray(p) for p in parts ])
+    else:
+        matrix = np.empty((0, 0))
+    del parts
+
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=parent, prefix=".tmp-")
+    try:
+        np.save(os.path.join(tmp, "ids.npy"), np.asarray(ids, dtype=np.int64))
+        np.save(os.path.join(tmp, "project_ids.npy"), np.asarray(project_ids, dtype=np.int64))
+        if sparse:
+            np.save(os.path.join(tmp, "data.npy"), matrix.data)
+            np.save(os.path.join(tmp, "indices.npy"), matrix.indices)
+            np.save(os.path.join(tmp, "indptr.npy"), matrix.indptr)
+        else:
+            np.save(os.path.join(tmp, "dense.npy"), matrix)
+        with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({ "version": STORE_VERSION, "sparse": sparse, "shape": list(matrix.shape), "dtype": matrix.dtype.name }, f)
+        os.rename(tmp, path)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+        if not os.path.isdir(path):
+            raise
+    return VectorStore(path)
+
+
+def open_store(config: Tuple, digest: str, directory: str = STORE_DIR, dtype=np.float64) -> Optional[VectorStore]:
+    """Opens the store of a configuration and corpus, or returns None if it has not been built."""
+    path = os.path.join(directory, fingerprint(config, digest, dtype))
+    if not os.path.isfile(os.path.join(path, "meta.json")):
+        return None
+    return VectorStore(path)
+
+
+def get_store(config: Tuple, source: corpus.CorpusSource, fit: Callable[[], Any], directory: str = STORE_DIR, batch_size: int = BATCH_SIZE,
+        dtype=np.float64) -> VectorStore:
+    """Opens the store of a configuration and corpus, building it with the vectorizer returned by fit() if necessary.
+
+    fit() must return a vectorizer with vectors in dtype (see vectorizer.get_vectorizer).
+    """
+    digest = source.digest()
+    store = open_store(config, digest, directory, dtype)
+    if store is None:
+        store = build_store(os.path.join(directory, fingerprint(config, digest, dtype)), source, fit(), batch_size)
+    return store
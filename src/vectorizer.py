@@ -1,142 +1,320 @@
+import os
 import re
-import tempfile
+import zlib
 
+from collections.abc import Sequence
 from typing import *
 
 import numpy as np
+from scipy.sparse import csr_matrix, isspmatrix
 
-from gensim.sklearn_api import D2VTransformer
-from gensim.sklearn_api import W2VTransformer
+import backends
+import tokens
 
-from sklearn.base import BaseEstimator
-from sklearn.decomposition import FastICA
-from sklearn.decomposition import LatentDirichletAllocation
-from sklearn.decomposition import KernelPCA
-from sklearn.decomposition import NMF
-from sklearn.decomposition import TruncatedSVD
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.feature_selection import VarianceThreshold
-from sklearn.pipeline import make_pipeline
-from sklearn.preprocessing import FunctionTransformer
-from sklearn.preprocessing import Normalizer
-from sklearn.random_projection import SparseRandomProjection
-from sklearn.svm import LinearSVC
+if TYPE_CHECKING:
+    from sklearn.base import BaseEstimator
 
-import ppmi
+LANDMARKS_PER_COMPONENT = 2     # Nystroem landmarks of kpca per component
+MAX_INT32 = np.iinfo(np.int32).max
 
 
 def _tokenize(X, y=None):
     return [ re.compile(r"(?u)\b\w\w+\b").findall(doc) for doc in X.tolist() ]
 
 
-def get_vectorizer(dataset: List[str], fselect: Tuple[str, ...], vsm: str, tsim: Tuple[str, ...], use_stop_words: bool, max_df: float, lowercase: bool, use_normalizer: bool, ngram: int) -> BaseEstimator:
+def _seed_hash(seed_string):
+    # gensim seeds the initial vector of every word with hashfxn(word + seed), and the built-in hash of
+    # strings differs between processes. A module-level function rather than a lambda, so models can be pickled
+    return zlib.crc32(seed_string.encode("utf-8"))
+
+
+def _astype(X, dtype="float64"):
+    # Dense vectors in dtype, sparse ones also with int32 indices if they fit
+    if not isspmatrix(X):
+        return np.asarray(X, dtype=dtype)
+    X = csr_matrix(X).astype(dtype, copy=False)
+    if X.nnz <= MAX_INT32 and X.shape[1] <= MAX_INT32 and X.indices.dtype != np.int32:
+        X = csr_matrix((X.data, X.indices.astype(np.int32), X.indptr.astype(np.int32)), shape=X.shape, copy=False)
+    return X
+
+
+def as_dtype(dtype) -> "BaseEstimator":
+    """A stage that casts vectors to dtype (e.g. np.float32), with int32 indices where possible."""
+    from sklearn.preprocessing import FunctionTransformer
+    return FunctionTransformer(func=_astype, kw_args={ "dtype": np.dtype(dtype).name }, validate=False)
+
+
+class _TaggedDocuments(Sequence):
+    # The documents tagged with their index, as Doc2Vec takes them, built when they are accessed
+    def __init__(self, documents: "tokens.Documents"):
+        from gensim.models.doc2vec import TaggedDocument
+        self.__documents = documents
+        self.__tagged = TaggedDocument
+
+    def __len__(self) -> int:
+        return len(self.__documents)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [ self[j] for j in range(*i.indices(len(self))) ]
+        return self.__tagged(self.__documents[i], [i])
+
+
+VSMS = backends.Registry("vsm")
+REDUCTIONS = backends.Registry("tid")
+EMBEDDINGS = backends.Registry("tid")
+
+
+def register_vsm(name: str, factory: Union[str, Callable[..., "BaseEstimator"]]):
+    """Registers a vsm, e.g. register_vsm("bm25", "mypackage.bm25:BM25Vectorizer").
+
+    factory(*args, n_jobs=n_jobs, **kwargs) gets the arguments of a vsm
+    ("name", *args) of a configuration and the keyword arguments of
+    CountVectorizer (plus dtype) that the configuration implies. The
+    vectorizer must also implement fit_transform_counts(counts, terms), see
+    tfidf.TfidfVectorizer.
+    """
+    VSMS.register(name, factory)
+
+
+def register_reduction(name: str, factory: Union[str, Callable[..., "BaseEstimator"]]):
+    """Registers a dimensionality reduction, e.g. register_reduction("umap", "mypackage.reductions:umap").
+
+    factory(*args, n_jobs=n_jobs) returns the unfitted reduction of a tsim
+    ("name", *args) of a configuration. It is fitted on the (sparse) output of
+    the vsm and put between the vsm and the Normalizer, so third-party
+    reductions are also staged by stagefit.StagedFitter.
+    """
+    REDUCTIONS.register(name, factory)
+
+
+def register_embedding(name: str, factory: Union[str, Callable[..., "BaseEstimator"]]):
+    """Registers an embedding that is trained on the documents themselves, like word2vec.
+
+    factory(dataset, *args, max_df=max_df, use_normalizer=use_normalizer,
+    ngram=ngram, workers=workers) returns the fitted transformer of a tsim
+    ("name", *args) of a configuration, trained on workers threads.
+    """
+    EMBEDDINGS.register(name, factory)
+
+
+def _tfidf(n_jobs=1, **kwargs):
+    import tfidf
+    return tfidf.TfidfVectorizer(**kwargs)
+
+
+def _ppmi(alpha=1.0):
+    def factory(n_jobs=1, **kwargs):
+        import ppmi
+        return ppmi.PPMIVectorizer(alpha, **kwargs)
+    return factory
+
+
+def _hashed(weighting, alpha=1.0):
+    # Hashed variants take the number of buckets, e.g. ("hashppmi", 2 ** 20)
+    def factory(n_features=None, n_jobs=1, **kwargs):
+        import hashvsm
+        return hashvsm.HashedVectorizer(weighting, alpha, n_features=n_features or hashvsm.N_FEATURES, n_jobs=n_jobs, **kwargs)
+    return factory
+
+
+register_vsm("tfidf", _tfidf)
+register_vsm("ppmi", _ppmi())
+register_vsm("ppmicds", _ppmi(0.75))
+register_vsm("hashtfidf", _hashed("tfidf"))
+register_vsm("hashppmi", _hashed("ppmi"))
+register_vsm("hashppmicds", _hashed("ppmi", 0.75))
+
+
+def _lsa(n_components, n_jobs=1):
+    from sklearn.decomposition import TruncatedSVD
+    return TruncatedSVD(n_components = n_components, random_state = 410)
+
+
+def _kpca(n_components, n_jobs=1):
+    from sklearn.decomposition import PCA
+    from sklearn.kernel_approximation import Nystroem
+    from sklearn.pipeline import make_pipeline
+    # Instead of the n x n kernel matrix, kernel PCA of the features of a Nystroem approximation with
+    # LANDMARKS_PER_COMPONENT * k landmarks: O(n * k) memory besides the landmarks themselves
+    return make_pipeline(Nystroem(kernel = "linear", n_components = LANDMARKS_PER_COMPONENT * n_components, random_state = 410),
+        PCA(n_components = n_components, random_state = 410))
+
+
+def _lda(n_topics, n_jobs=1):
+    import topics
+    return topics.BudgetedLDA(n_topics = n_topics, batch_size = 16384, learning_decay = 0.8, random_state = 410, n_jobs = n_jobs)
+
+
+def _ica(n_components, n_jobs=1):
+    from sklearn.decomposition import PCA, FastICA, TruncatedSVD
+    from sklearn.pipeline import make_pipeline
+    # Instead of the dense n x |V| matrix, ICA of its whitened projection onto the k largest singular vectors
+    # (randomized SVD of the sparse matrix): O(n * k) memory besides the k x |V| components, like LSA
+    return make_pipeline(TruncatedSVD(n_components = n_components, random_state = 410), PCA(n_components = n_components, whiten = True, random_state = 410),
+        FastICA(whiten = False, random_state = 410))
+
+
+def _nmf(n_components, n_jobs=1):
+    from sklearn.decomposition import NMF
+    return NMF(n_components = n_components, alpha = 0.75, random_state = 410)
+
+
+def _srp(n_components, n_jobs=1):
+    from sklearn.random_projection import SparseRandomProjection
+    return SparseRandomProjection(n_components = n_components, random_state = 410)
+
+
+register_reduction("lsa", _lsa)
+register_reduction("kpca", _kpca)
+register_reduction("lda", _lda)
+register_reduction("ica", _ica)
+register_reduction("nmf", _nmf)
+register_reduction("srp", _srp)
+
+
+def _word2vec(dataset, size, max_df, use_normalizer, ngram, workers):
+    from gensim.sklearn_api import W2VTransformer
+    import wordvecs
+    basict = W2VTransformer(size=size, min_count=1, seed=410, sample=0.0 if max_df >= 1.0 else max_df, workers=workers, sg=0 if use_normalizer else 1, window=10 if use_normalizer else 5, hs=1 if ngram <= 2 else 0, negative=0 if ngram < 2 else 10, hashfxn=_seed_hash)
+    # The cased tokens, as _tokenize() finds them
+    basict.fit(tokens.tokenize(dataset).cased.documents())
+    # Only the word vectors are kept, documents are embedded in batches
+    return wordvecs.WordVectorSum.from_keyed_vectors(basict.gensim_model.wv)
+
+
+def _doc2vec(dataset, size, max_df, use_normalizer, ngram, workers):
+    from gensim.sklearn_api import D2VTransformer
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import FunctionTransformer
+    d2vt = D2VTransformer(size=size, min_count=1, seed=410, sample=0.0 if max_df >= 1.0 else max_df, workers=workers, hashfxn=_seed_hash, dm=0 if use_normalizer else 1, window=5, hs=1 if ngram <= 2 else 0, negative=0 if ngram < 2 else 10)
+    d2vt.fit(_TaggedDocuments(tokens.tokenize(dataset).cased.documents()))
+    return make_pipeline(FunctionTransformer(func=_tokenize, validate=False), d2vt)
+
+
+register_embedding("word2vec", _word2vec)
+register_embedding("doc2vec", _doc2vec)
+
+
+def _variance_threshold(fselect: Tuple[str, ...]) -> Optional["BaseEstimator"]:
+    # The feature selection of a configuration, None for all features
+    if fselect[0] == "var":
+        from sklearn.feature_selection import VarianceThreshold
+        return VarianceThreshold(threshold=fselect[1])
+    elif fselect[0] != "all":
+        raise Exception("Unknown feature selector: " + fselect[0])
+    return None
+
+
+def get_weighting(fselect: Tuple[str, ...], vsm: Union[str, Tuple[str, int]], use_stop_words: bool, max_df: float, lowercase: bool, ngram: int, n_jobs: int = 1, dtype=np.float64) -> "BaseEstimator":
+    """The unfitted term weighting stage of a configuration, including its feature selection, with vectors in dtype."""
+    (vid, *vargs) = vsm if isinstance(vsm, tuple) else (vsm, )
+    factory = VSMS.get(vid)
+    if use_stop_words:
+        weighting = factory(*vargs, n_jobs=n_jobs, stop_words = "english", lowercase = lowercase, ngram_range=(ngram, ngram), dtype=dtype)
+    else:
+        weighting = factory(*vargs, n_jobs=n_jobs, max_df = max_df, lowercase = lowercase, ngram_range=(ngram, ngram), dtype=dtype)
+
+    var = _variance_threshold(fselect)
+    if var is not None:
+        from sklearn.pipeline import make_pipeline
+        weighting = make_pipeline(weighting, var)
+    return weighting
+
+
+def fit_weighting(dataset: Iterable[str], fselect: Tuple[str, ...], vsm: Union[str, Tuple[str, int]], use_stop_words: bool, max_df: float, lowercase: bool, ngram: int, n_jobs: int = 1, dtype=np.float64,
+        token_cache: Optional[tokens.TokenCache] = None) -> Tuple["BaseEstimator", Any]:
+    """Fits the term weighting stage of a configuration on dataset, and returns it with the vectors of dataset.
+
+    The n-grams and their counts are built from the token ids of
+    tokens.tokenize(dataset, token_cache), so with a token_cache the
+    documents are not tokenized again for every configuration. The fitted
+    stage transforms strings like one fitted on the documents themselves.
+    """
+    view = tokens.tokenize(dataset, token_cache).view(lowercase)
+    if use_stop_words:
+        from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+        view = view.without(ENGLISH_STOP_WORDS)
+    (counts, terms) = view.ngrams(ngram).counts()
+    weighting = get_weighting(("all", ), vsm, use_stop_words, max_df, lowercase, ngram, n_jobs, dtype)
+    out = weighting.fit_transform_counts(counts, terms)
+    del counts
+
+    var = _variance_threshold(fselect)
+    if var is not None:
+        from sklearn.pipeline import make_pipeline
+        out = var.fit_transform(out)
+        weighting = make_pipeline(weighting, var)
+    return (weighting, out)
+
+
+def get_reduction(tsim: Tuple[str, ...], n_jobs: int = 1) -> "BaseEstimator":
+    """The unfitted dimensionality reduction of a configuration on top of its term weighting stage.
+
+    LDA is fitted on n_jobs cores (all for -1).
+    """
+    return REDUCTIONS.get(tsim[0])(*tsim[1:], n_jobs=n_jobs)
+
+
+def assemble(weighting: "BaseEstimator", reduction: Optional["BaseEstimator"] = None, use_normalizer: bool = False, dtype=np.float64) -> "BaseEstimator":
+    """The pipeline of a configuration from its fitted stages.
+
+    The weighting stage already produces vectors in dtype; the output of the
+    reduction is cast to it (unless it is float64), and the Normalizer keeps
+    the dtype of its input.
+    """
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import Normalizer
+    steps = [ weighting ]
+    if reduction is not None:
+        steps.append(reduction)
+        if np.dtype(dtype) != np.float64:
+            steps.append(as_dtype(dtype))
+    if use_normalizer:
+        steps.append(Normalizer())
+    return steps[0] if len(steps) == 1 else make_pipeline(*steps)
+
+
+def _fit_vectorizer(dataset: Iterable[str], fselect: Tuple[str, ...], vsm: Union[str, Tuple[str, int]], tsim: Tuple[str, ...], use_stop_words: bool, max_df: float, lowercase: bool, use_normalizer: bool, ngram: int, n_jobs: int = 1, dtype=np.float64,
+        workers: Optional[int] = None) -> "BaseEstimator":
     try:
-        def get_vsmvec(vsm):
-            if vsm == "tfidf":
-                return TfidfVectorizer
-            elif vsm == "ppmi":
-                return ppmi.PPMIVectorizer
-            elif vsm == "ppmicds":
-                return lambda **kwargs: ppmi.PPMIVectorizer(0.75, **kwargs)
-            else:
-                raise Exception("Unknown vsm: " + vsm)
-
-        pretrans = None # No preprocessing used here
+        # Training threads of word2vec and doc2vec (n_jobs by default). Their results only depend on the seed with a single thread
+        workers = workers or n_jobs
+        workers = workers if workers > 0 else os.cpu_count()
 
         tid = tsim[0]
-        if tid in ["none", "lsa", "kpca", "lda", "ica", "nmf", "srp"]:
-            if use_stop_words:
-                tfidf = get_vsmvec(vsm)(stop_words = "english", lowercase = lowercase, ngram_range=(ngram, ngram))
-            else:
-                tfidf = get_vsmvec(vsm)(max_df = max_df, lowercase = lowercase, ngram_range=(ngram, ngram))
-            if pretrans != None:
-                tfidf = make_pipeline(pretrans, tfidf)
-
-            if fselect[0] == "var":
-                tfidf = make_pipeline(tfidf, VarianceThreshold(threshold=fselect[1]))
-            elif fselect[0] != "all":
-                raise Exception("Unknown feature selector: " + fselect[0])
-
-            inp = np.asarray(dataset)
+        if tid == "none" or tid in REDUCTIONS:
+            # The reductions are fitted on the vectors in dtype
+            (tfidf, out) = fit_weighting(dataset, fselect, vsm, use_stop_words, max_df, lowercase, ngram, n_jobs, dtype)
             if tid == "none":
-                tfidf.fit(inp)
-                if use_normalizer:
-                    return make_pipeline(tfidf, Normalizer())
-                else:
-                    return tfidf
-            elif tid == "lsa":
-                lsa = TruncatedSVD(n_components = tsim[1], random_state = 410)
-                out = tfidf.fit_transform(inp)
-                lsa.fit(out)
-                if use_normalizer:
-                    return make_pipeline(tfidf, lsa, Normalizer())
-                else:
-                    return make_pipeline(tfidf, lsa)
-            elif tid == "kpca":
-                kpca = KernelPCA(n_components = tsim[1], copy_X = False)
-                out = tfidf.fit_transform(inp)
-                kpca.fit(out)
-                if use_normalizer:
-                    return make_pipeline(tfidf, kpca, Normalizer())
-                else:
-                    return make_pipeline(tfidf, kpca)
-            elif tid == "lda":
-                lda = LatentDirichletAllocation(n_topics = tsim[1], learning_method = "online", batch_size = 16384, learning_decay = 0.8, random_state = 410)
-                out = tfidf.fit_transform(inp)
-                lda.fit(out)
-                if use_normalizer:
-                    return make_pipeline(tfidf, lda, Normalizer())
-                else:
-                    return make_pipeline(tfidf, lda)
-            elif tid == "ica":
-                ica = FastICA(n_components = tsim[1])
-                out = tfidf.fit_transform(inp).todense()
-                ica.fit(out)
-                if use_normalizer:
-                    return make_pipeline(tfidf, ica, Normalizer())
-                else:
-                    return make_pipeline(tfidf, lda)
-            elif tid == "nmf":
-                nmf = NMF(n_components = tsim[1], alpha = 0.75, random_state = 410)
-                out = tfidf.fit_transform(inp)
-                nmf.fit(out)
-                if use_normalizer:
-                    return make_pipeline(tfidf, nmf, Normalizer())
-                else:
-                    return make_pipeline(tfidf, nmf)
-            elif tid == "srp":
-                srp = SparseRandomProjection(n_components = tsim[1], random_state = 410)
-                out = tfidf.fit_transform(inp)
-                srp.fit(out)
-                if use_normalizer:
-                    return make_pipeline(tfidf, srp, Normalizer())
-                else:
-                    return make_pipeline(tfidf, srp)
-            else:
-                raise Exception("Unknown tid: " + tid)
-        elif tid == "word2vec":
-            basict = W2VTransformer(size=tsim[1], min_count=1, seed=410, sample=0.0 if max_df >= 1.0 else max_df, workers=1, sg=0 if use_normalizer else 1, window=10 if use_normalizer else 5, hs=1 if ngram <= 2 else 0, negative=0 if ngram < 2 else 10)
-            w2vt = FunctionTransformer(func=lambda X, y=None, basict=basict: np.asarray([ sum(basict.transform(doc)) for doc in X ]), validate=False)
-            if pretrans != None:
-                w2vf = make_pipeline(pretrans, FunctionTransformer(func=_tokenize, validate=False), basict)
-                w2vt = make_pipeline(pretrans, FunctionTransformer(func=_tokenize, validate=False), w2vt)
-            else:
-                w2vf = make_pipeline(FunctionTransformer(func=_tokenize, validate=False), basict)
-                w2vt = make_pipeline(FunctionTransformer(func=_tokenize, validate=False), w2vt)
-            w2vf.fit(np.asarray(dataset))
-            return w2vt
-            #return TransformerWrapper(lambda doc, model=model: model[re.sub(r",\s*", "_", doc)])
-        elif tid == "doc2vec":
-            d2vt = D2VTransformer(size=tsim[1], min_count=1, seed=410, sample=0.0 if max_df >= 1.0 else max_df, workers=1, dm=0 if use_normalizer else 1, window=5, hs=1 if ngram <= 2 else 0, negative=0 if ngram < 2 else 10)
-            tokt = FunctionTransformer(func=_tokenize, validate=False)
-            if pretrans != None:
-                d2vt = make_pipeline(pretrans, tokt, d2vt)
-            else:
-                d2vt = make_pipeline(tokt, d2vt)
-            d2vt.fit(np.asarray(dataset))
-            return d2vt
+                return assemble(tfidf, None, use_normalizer, dtype)
+            reduction = get_reduction(tsim, n_jobs)
+            reduction.fit(out)
+            return assemble(tfidf, reduction, use_normalizer, dtype)
+        elif tid in EMBEDDINGS:
+            embedding = EMBEDDINGS.get(tid)(dataset, *tsim[1:], max_df=max_df, use_normalizer=use_normalizer, ngram=ngram, workers=workers)
+            # gensim embeds in float32, whatever dtype is
+            from sklearn.pipeline import make_pipeline
+            return make_pipeline(embedding, as_dtype(dtype))
         else:
             raise Exception("Unknown tid: " + str(tid))
     except MemoryError as e:
-        print("[E] out of memory on configuration " + vsm + ", " + str(tsim) + ", " + str(use_stop_words) + ", " + str(max_df) + ", " + str(lowercase) + ", " + str(use_normalizer) + ", " + str(ngram))
+        print("[E] out of memory on configuration " + str(vsm) + ", " + str(tsim) + ", " + str(use_stop_words) + ", " + str(max_df) + ", " + str(lowercase) + ", " + str(use_normalizer) + ", " + str(ngram))
         raise
+
+
+def get_vectorizer(dataset: Iterable[str], fselect: Tuple[str, ...], vsm: Union[str, Tuple[str, int]], tsim: Tuple[str, ...], use_stop_words: bool, max_df: float, lowercase: bool, use_normalizer: bool, ngram: int, n_jobs: int = 1, dtype=np.float64,
+        workers: Optional[int] = None) -> "BaseEstimator":
+    # With n_jobs != 1, transform() runs on a pool of n_jobs processes (all cores for -1), and word2vec and
+    # doc2vec train on as many threads unless workers gives their number (e.g. 1 for reproducible models).
+    # With another dtype than float64 (e.g. np.float32), every stage produces vectors in it, and sparse
+    # ones have int32 indices where possible
+    return parallelize(_fit_vectorizer(dataset, fselect, vsm, tsim, use_stop_words, max_df, lowercase, use_normalizer, ngram, n_jobs, dtype, workers), n_jobs)
+
+
+def parallelize(vect: "BaseEstimator", n_jobs: int) -> "BaseEstimator":
+    """Wraps a fitted vectorizer, so its transform() runs on n_jobs processes unless n_jobs is 1."""
+    if n_jobs == 1:
+        return vect
+    import partransform
+    return partransform.ParallelTransformer(vect, n_jobs)
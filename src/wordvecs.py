@@ -0,0 +1,54 @@
+import re
+
+from array import array
+from typing import *
+
+import numpy as np
+
+from sklearn.base import BaseEstimator, TransformerMixin
+
+import tokens
+
+
+class WordVectorSum(BaseEstimator, TransformerMixin):
+    """Embeds documents as the sum of the vectors of their words, compatible with scikit-learn.
+
+    The documents of a batch are tokenized like tokens.TokenizedCorpus
+    (cased), their words are mapped to rows of the embedding matrix, and the
+    rows are gathered and summed per document in one vectorized step. Words
+    without a vector are skipped; documents without any get a zero vector.
+    """
+
+    def __init__(self, terms: List[str], vectors: np.ndarray):
+        self.__index = { term: i for (i, term) in enumerate(terms) }
+        # Unknown words map to the extra zero row
+        self.__vectors = np.vstack([ vectors, np.zeros((1, vectors.shape[1]), dtype=vectors.dtype) ])
+
+    @classmethod
+    def from_keyed_vectors(cls, wv) -> "WordVectorSum":
+        """From the word vectors of a trained gensim model (e.g. W2VTransformer().fit(X).gensim_model.wv)."""
+        # index2word was renamed to index_to_key in gensim 4
+        terms = wv.index2word if hasattr(wv, "index2word") else wv.index_to_key
+        return cls(terms, np.asarray(wv.vectors))
+
+    def fit(self, X, y=None, **fit_params):
+        return self
+
+    def transform(self, X, y=None, **fit_params):
+        pattern = re.compile(tokens.TOKEN_PATTERN)
+        index = self.__index
+        unknown = len(index)
+        ids = array("i")
+        offsets = [0]
+        for doc in X:
+            ids.extend([ index.get(token, unknown) for token in pattern.findall(doc) ])
+            offsets.append(len(ids))
+        ids = np.frombuffer(ids, dtype=np.int32)
+        offsets = np.asarray(offsets, dtype=np.int64)
+
+        sums = np.zeros((len(offsets) - 1, self.__vectors.shape[1]), dtype=self.__vectors.dtype)
+        nonempty = offsets[1:] > offsets[:-1]
+        if nonempty.any():
+            # Empty documents add no rows, so the segments of the others end where the next one starts
+            sums[nonempty] = np.add.reduceat(self.__vectors[ids], offsets[:-1][nonempty], axis=0)
+        return sums